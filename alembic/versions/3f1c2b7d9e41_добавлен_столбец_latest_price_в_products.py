@@ -0,0 +1,41 @@
+"""Добавлен столбец latest_price в таблицу products
+
+Revision ID: 3f1c2b7d9e41
+Revises: a9f6eb4e0dd4
+Create Date: 2026-10-18 10:12:31.402815
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c2b7d9e41'
+down_revision: Union[str, Sequence[str], None] = 'a9f6eb4e0dd4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. Добавляем столбец с последней предыдущей ценой
+    op.add_column('products', sa.Column('latest_price', sa.Float(), nullable=True))
+
+    # 2. Заполняем его самой свежей записью из истории цен
+    op.execute('''
+        UPDATE products
+        SET latest_price = last_prices.price
+        FROM (
+            SELECT DISTINCT ON (product_id) product_id, price
+            FROM product_prices
+            ORDER BY product_id, created_at DESC, id DESC
+        ) AS last_prices
+        WHERE products.id = last_prices.product_id
+    ''')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('products', 'latest_price')
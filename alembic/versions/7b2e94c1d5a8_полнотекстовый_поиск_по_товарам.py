@@ -0,0 +1,44 @@
+"""Полнотекстовый поиск по товарам (столбец search_vector и GIN индекс)
+
+Revision ID: 7b2e94c1d5a8
+Revises: 3f1c2b7d9e41
+Create Date: 2026-10-18 11:40:05.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b2e94c1d5a8'
+down_revision: Union[str, Sequence[str], None] = '3f1c2b7d9e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1. Генерируемый столбец tsvector (название и артикул - вес A, описание - вес B)
+    op.add_column('products', sa.Column(
+        'search_vector',
+        postgresql.TSVECTOR(),
+        sa.Computed(
+            "setweight(to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(sku, '')), 'A') || "
+            "setweight(to_tsvector('russian', coalesce(description, '')), 'B')",
+            persisted=True
+        ),
+        nullable=True
+    ))
+
+    # 2. GIN индекс для поиска по столбцу
+    op.create_index('ix_products_search_vector', 'products', ['search_vector'],
+                    unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_products_search_vector', table_name='products', postgresql_using='gin')
+    op.drop_column('products', 'search_vector')
@@ -0,0 +1,45 @@
+"""Уникальная позиция корзины (user_id, product_id)
+
+Revision ID: a3c7e9b1d5f4
+Revises: e1f5a9c3b7d2
+Create Date: 2026-10-18 18:42:09.573160
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c7e9b1d5f4'
+down_revision: Union[str, Sequence[str], None] = 'e1f5a9c3b7d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Объединяем повторяющиеся позиции: количество суммируется в позиции с меньшим id
+    op.execute("""
+        UPDATE cart_items AS c
+        SET quantity = d.total
+        FROM (
+            SELECT min(id) AS id, sum(quantity) AS total
+            FROM cart_items
+            GROUP BY user_id, product_id
+            HAVING count(*) > 1
+        ) AS d
+        WHERE c.id = d.id
+    """)
+    op.execute("""
+        DELETE FROM cart_items AS c
+        USING cart_items AS k
+        WHERE c.user_id = k.user_id AND c.product_id = k.product_id AND c.id > k.id
+    """)
+    op.create_unique_constraint('uq_cart_items_user_id_product_id', 'cart_items', ['user_id', 'product_id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_cart_items_user_id_product_id', 'cart_items', type_='unique')
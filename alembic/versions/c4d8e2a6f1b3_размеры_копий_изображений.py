@@ -0,0 +1,32 @@
+"""Размеры уменьшенных копий фото товаров, категорий и подкатегорий
+
+Revision ID: c4d8e2a6f1b3
+Revises: 7b2e94c1d5a8
+Create Date: 2026-10-18 14:05:31.624017
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4d8e2a6f1b3'
+down_revision: Union[str, Sequence[str], None] = '7b2e94c1d5a8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('product_images', sa.Column('variants', sa.JSON(), nullable=True))
+    op.add_column('categories', sa.Column('picture_variants', sa.JSON(), nullable=True))
+    op.add_column('sub_categories', sa.Column('picture_variants', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('sub_categories', 'picture_variants')
+    op.drop_column('categories', 'picture_variants')
+    op.drop_column('product_images', 'variants')
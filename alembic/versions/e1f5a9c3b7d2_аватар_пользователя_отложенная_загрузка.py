@@ -0,0 +1,30 @@
+"""Время загрузки аватара пользователя
+
+Revision ID: e1f5a9c3b7d2
+Revises: c4d8e2a6f1b3
+Create Date: 2026-10-18 16:20:47.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f5a9c3b7d2'
+down_revision: Union[str, Sequence[str], None] = 'c4d8e2a6f1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('users', sa.Column('avatar_updated_at', sa.DateTime(timezone=True), nullable=True))
+    # У уже загруженных аватаров время загрузки неизвестно - используем время миграции
+    op.execute("UPDATE users SET avatar_updated_at = now() WHERE avatar IS NOT NULL")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('users', 'avatar_updated_at')
@@ -7,9 +7,16 @@ from flask_wtf import CSRFProtect
 from flask_wtf.csrf import generate_csrf
 
 from extensions import db
-from services import DATABASE_URL_FOR_FLASK, create_inject_cart_len
+from services import DATABASE_URL_FOR_FLASK, create_inject_cart_len, ProductService
 from blueprints import header, catalog, admin
 from services.UserLogin import UserLogin
+from services.compression import CompressionMiddleware
+from services.static_assets import init_static_assets
+from services.images import picture, image_url
+from services.image_cache import ImageResizeCache
+from services.image_backfill import regenerate_images_command
+from services.cache import catalog_stamp
+from services.http_cache import init_build_version
 from sheduler import setup_scheduler
 
 
@@ -38,6 +45,27 @@ def create_app():
     app.config['CATALOG_UPLOAD_FOLDER'] = os.path.join(upload_folder, 'catalog')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # 16 МБ максимальный размер файла
     app.config['SCHEDULER_API_ENABLED'] = True
+    # Поиск товаров: 'postgres' - полнотекстовый поиск в БД, 'memory' - индекс в памяти процесса
+    app.config['SEARCH_BACKEND'] = env('SEARCH_BACKEND', 'postgres')
+    # Кэш страниц каталога для анонимных посетителей
+    app.config['PAGE_CACHE_ENABLED'] = env.bool('PAGE_CACHE_ENABLED', True)
+    # Сжатие ответов (можно отключить, если сжатием занимается nginx)
+    app.config['COMPRESS_ENABLED'] = env.bool('COMPRESS_ENABLED', True)
+    app.config['COMPRESS_LEVEL'] = env.int('COMPRESS_LEVEL', 6)
+    app.config['COMPRESS_BROTLI_QUALITY'] = env.int('COMPRESS_BROTLI_QUALITY', 5)
+    app.config['COMPRESS_MIN_SIZE'] = env.int('COMPRESS_MIN_SIZE', 500)
+    # Отдача статики и изображений фронтовым сервером: '' (отдает Flask), 'x-accel' (nginx) или 'x-sendfile'
+    app.config['STATIC_OFFLOAD'] = env('STATIC_OFFLOAD', '')
+    app.config['STATIC_OFFLOAD_PREFIX'] = env('STATIC_OFFLOAD_PREFIX', '/protected')
+    app.config['STATIC_OFFLOAD_ROOT'] = env('STATIC_OFFLOAD_ROOT', '')
+    # Дисковый кэш изображений, уменьшаемых по запросу (/catalog/img/<ширина>x<высота>/<путь>)
+    app.config['IMAGE_CACHE_FOLDER'] = env('IMAGE_CACHE_FOLDER', '') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache', 'images')
+    app.config['IMAGE_CACHE_MAX_MB'] = env.int('IMAGE_CACHE_MAX_MB', 200)
+    # Файл-отметка изменения каталога: по нему процессы сервера сбрасывают кэши каталога
+    # после изменений в других процессах (например, flask regenerate-images)
+    app.config['CATALOG_STAMP_FILE'] = env('CATALOG_STAMP_FILE', '') or \
+        os.path.join(os.path.abspath(os.path.dirname(__file__)), 'cache', 'catalog.stamp')
 
     # Активируем глобальную защиту от CSRF-атак (необходимо для AJAX-запросов)
     csrf = CSRFProtect(app)
@@ -47,20 +75,52 @@ def create_app():
     def before_request():
         g.csrf_token=generate_csrf()
 
+    # Сбрасываем кэши каталога, если его изменил другой процесс
+    catalog_stamp.init(app.config['CATALOG_STAMP_FILE'])
+
+    @app.before_request
+    def sync_catalog_caches():
+        if catalog_stamp.changed():
+            ProductService.clear_catalog_caches()
+
     # Создаем папку для загрузок, если ее нет
     os.makedirs(app.config['CATALOG_UPLOAD_FOLDER'], exist_ok=True)
 
+    # Кэш уменьшенных изображений
+    os.makedirs(app.config['IMAGE_CACHE_FOLDER'], exist_ok=True)
+    app.extensions['image_resize_cache'] = ImageResizeCache(
+        app.config['IMAGE_CACHE_FOLDER'],
+        max_bytes=app.config['IMAGE_CACHE_MAX_MB'] * 1024 * 1024,
+    )
+
     # Подключаем blueprints
     app.register_blueprint(header, url_prefix='/')
     app.register_blueprint(catalog, url_prefix='/catalog')
     app.register_blueprint(admin, url_prefix='/admin')
 
+    # Хэши в URL статических файлов, долгое кэширование и сжатые копии CSS/JS
+    # (копии создаются командой: flask --app wsgi compress-static)
+    init_static_assets(app)
+    # Уменьшенные копии для уже загруженных фото: flask --app wsgi regenerate-images
+    app.cli.add_command(regenerate_images_command)
+    # Версия шаблонов и статики для ETag страниц
+    app.config['BUILD_VERSION'] = env('BUILD_VERSION', '')
+    init_build_version(app)
+
     # Подключаем контекстный процессор (определяет переменную в каждом html шаблоне)
     app.context_processor(create_inject_cart_len(db))
+    # Вывод фото каталога с уменьшенными копиями (srcset)
+    app.add_template_global(picture)
+    app.add_template_global(image_url)
 
     # Инициализируем расширения
     db.init_app(app)
 
+    # Строим поисковый индекс в памяти (если выбран такой способ поиска)
+    if app.config['SEARCH_BACKEND'] == 'memory':
+        with app.app_context():
+            ProductService(db).build_search_index()
+
     # Настройка доступа к страницам неавторизованным пользователям
     login_manager = LoginManager(app)
     login_manager.login_view = 'header.login'
@@ -71,6 +131,15 @@ def create_app():
         # Получаем пользователя из БД
         return UserLogin().fromDB(db, user_id)
 
+    # Сжимаем HTML, JSON, CSS и JS (gzip или brotli)
+    if app.config['COMPRESS_ENABLED']:
+        app.wsgi_app = CompressionMiddleware(
+            app.wsgi_app,
+            level=app.config['COMPRESS_LEVEL'],
+            brotli_quality=app.config['COMPRESS_BROTLI_QUALITY'],
+            min_size=app.config['COMPRESS_MIN_SIZE'],
+        )
+
     # Настройка планировщика задач
     scheduler = setup_scheduler(db, app)
     scheduler.init_app(app)
@@ -10,7 +10,7 @@ from werkzeug.utils import secure_filename
 from extensions import db
 from models import Category, SubCategory
 from services import (ProductService, create_path_for_file, build_admin_orders_sort_column,
-                      CartService, UserService, AdminService)
+                      CartService, UserService, AdminService, create_derivatives, delete_derivatives)
 from forms import (CategoryForm, CategoryEditForm, ProductForm, ProductEditForm,
                    EditProfileForm)
 
@@ -148,18 +148,16 @@ def user_delete(user_id):
 def products():
     """Функция генерирует страницу со всеми категориями, подкатегориями и товарами"""
     product_service = ProductService(db)
-    categories = product_service.get_category_list()
+    # Категории, подкатегории и товары загружаются за два запроса
+    categories = product_service.get_category_tree(with_products=True)
 
-    # Для каждой категории получаем ее подкатегории
     categories_with_products = []
     for cat in categories:
-        subcategories = product_service.get_subcategories_by_category_slug(cat_slug=cat.slug)
         subcategories_data = []
-        for subcategory in subcategories:
-            products_list = product_service.get_products_by_subcategory_slug(subcat_slug=subcategory.slug)
+        for subcategory in cat.subcategory:
             subcategories_data.append({
                 'subcategory': subcategory,
-                'products': products_list
+                'products': subcategory.products
             })
         categories_with_products.append({
             'category': cat,
@@ -183,8 +181,8 @@ def create_category(cat_slug=None):
 
     if form.validate_on_submit():
         if not cat_slug:
-            ok = product_service.create_category(form=form, object=Category)
-            if not ok:
+            category = product_service.create_category(form=form, object=Category)
+            if not category:
                 flash("Категория с указанным именем уже существует!", category="danger")
                 return render_template(
                     'admin/category_form.html',
@@ -193,8 +191,8 @@ def create_category(cat_slug=None):
             flash("Категория создана!", category="success")
         else:
             cat_id = product_service.get_category_by_slug(cat_slug=cat_slug).id
-            ok = product_service.create_category(form=form, object=SubCategory, cat_id=cat_id)
-            if not ok:
+            category = product_service.create_category(form=form, object=SubCategory, cat_id=cat_id)
+            if not category:
                 flash("Подкатегория с указанным именем уже существует!", category="danger")
                 return render_template(
                     'admin/category_form.html',
@@ -213,6 +211,8 @@ def create_category(cat_slug=None):
                                                       file_name=file_name
                                                       )
         file.save(filepath)
+        # Создаем уменьшенные копии фото
+        product_service.set_picture_variants(category=category, variants=create_derivatives(filepath))
         flash('Фото успешно загружено!', category="success")
 
         return redirect(url_for('admin.products'))
@@ -251,11 +251,12 @@ def edit_category(slug):
         product_service.edit_category(form=form, category=category)
         # Если загружено новое фото
         if form.picture.data:
-            # Удаляем старое фото
+            # Удаляем старое фото и его уменьшенные копии
             try:
                 os.remove(file_path)
             except FileNotFoundError:
                 flash("Не удается найти указанный файл", category="error")
+            delete_derivatives(file_path)
 
             # Загружаем новое фото
             file = form.picture.data
@@ -268,6 +269,7 @@ def edit_category(slug):
                                                           subfolders=['subcategories', cat_slug],
                                                           file_name=file_name)
             file.save(file_path)
+            product_service.set_picture_variants(category=category, variants=create_derivatives(file_path))
             flash('Фото успешно обновлено!', category="success")
 
         return redirect(url_for('admin.products'))
@@ -304,6 +306,7 @@ def delete_category(slug):
         os.remove(file_path)
     except FileNotFoundError:
         flash("Не удается найти указанный файл", category="error")
+    delete_derivatives(file_path)
 
     # Удаляем запись в БД
     product_service.delete_category(cat_slug=slug, object=object)
@@ -1,9 +1,13 @@
 from flask import (Blueprint, request, redirect, render_template,
-                   jsonify, url_for, session, flash)
+                   jsonify, url_for, session, flash, abort, g, make_response, send_file)
 from flask_login import current_user, login_required
 from sqlalchemy import desc, asc
 
-from services import UserService, ProductService, CartService, add_product_to_cart
+from services import (UserService, ProductService, CartService, add_product_to_cart,
+                      encode_cursor, ProductFilters, cache_anonymous_page, get_cart_len,
+                      image_url, image_srcset, build_version, make_etag, viewer_state,
+                      is_not_modified, set_validators, not_modified_response, resized_image_path,
+                      offload_file_response, get_guest_cart_items, get_guest_favorites)
 from extensions import db
 from models import Product
 from forms import OrderForm
@@ -19,18 +23,17 @@ catalog = Blueprint(
 
 
 @catalog.route('/')
+@cache_anonymous_page
 def catalog_index():
     product_service = ProductService(db)
-    categories = product_service.get_category_list()
-    cats_with_subcats = []
+    # Категории загружаются вместе с подкатегориями одним запросом
+    categories = product_service.get_category_tree()
     breadcrumbs = [
         {'name': 'DNS', 'endpoint': 'header.index'},
         {'name': 'Каталог', 'endpoint': None}
     ]
-    for category in categories:
-        subcategories = product_service.get_subcategories_by_category_slug(cat_slug=category.slug)
-        cats_with_subcats.append({'cat': category,
-                                  'subcat': subcategories})
+    cats_with_subcats = [{'cat': category, 'subcat': category.subcategory}
+                         for category in categories]
 
     return render_template(
         "catalog/catalog.html",
@@ -40,39 +43,55 @@ def catalog_index():
     )
 
 @catalog.route('/category/<category_slug>')
+@cache_anonymous_page
 def subcategory(category_slug):
     product_service = ProductService(db)
-    subcategories = product_service.get_subcategories_by_category_slug(cat_slug=category_slug)
+    # Категория, ее подкатегории и breadcrumbs берутся из дерева каталога в памяти
+    category = product_service.get_catalog_tree().category(category_slug)
+    if category is None:
+        abort(404)
 
-    category_name =  product_service.get_category_by_slug(cat_slug=category_slug).name
-    breadcrumbs = [
-        {'name': 'DNS', 'endpoint': 'header.index'},
-        {'name': 'Каталог', 'endpoint': 'catalog.catalog_index'},
-        {'name': category_name, 'endpoint': None},
-    ]
     return render_template(
         'catalog/catalog.html',
-        title=category_name,
-        categories=subcategories,
+        title=category.name,
+        categories=category.subcategories,
         cat_slug_if_subcats=category_slug,
-        breadcrumbs=breadcrumbs,
+        breadcrumbs=category.breadcrumbs,
     )
 
 @catalog.route('/subcategory/<subcategory_slug>')
 @catalog.route('/subcategory/<subcategory_slug>/<int:page>')
+@cache_anonymous_page
 def products(subcategory_slug, page=1):
     product_service = ProductService(db)
     cart_service = CartService(db)
 
-    pagination = product_service.get_products_by_subcategory_slug(
-        subcat_slug=subcategory_slug,
-        page=page,
-        per_page=8
-    )
-
-    category = product_service.get_category_by_subcategory_slug(subcat_slug=subcategory_slug)
-    category_name = category.name
-    category_slug = category.slug
+    subcategory = product_service.get_catalog_tree().subcategory(subcategory_slug)
+    if subcategory is None:
+        abort(404)
+
+    filters = ProductFilters.from_args(request.args)
+
+    # Если передан курсор - используем keyset-пагинацию (кнопка «Следующая»),
+    # иначе OFFSET-пагинацию (нумерованные ссылки на страницы)
+    cursor = request.args.get('cursor')
+    if cursor:
+        pagination = product_service.get_products_by_subcategory_cursor(
+            subcat_slug=subcategory_slug,
+            cursor=cursor,
+            per_page=8,
+            filters=filters
+        )
+        next_cursor = pagination.next_cursor
+    else:
+        pagination = product_service.get_products_by_subcategory_slug(
+            subcat_slug=subcategory_slug,
+            page=page,
+            per_page=8,
+            filters=filters
+        )
+        next_cursor = encode_cursor(sort_by='id', direction='asc', product=pagination.items[-1]) \
+            if pagination.has_next else None
 
     if current_user.is_authenticated:
         favorite_ids = cart_service.get_favorites_ids(user_id=current_user.get_id())
@@ -80,29 +99,35 @@ def products(subcategory_slug, page=1):
         favorite_items = session.get('favorite', [])
         favorite_ids = [int(item['product_id']) for item in favorite_items]
 
-    subcategory_name = product_service.get_subcategory_by_slug(subcat_slug=subcategory_slug).name
-    breadcrumbs = [
-        {'name': 'DNS', 'endpoint': 'header.index', 'params': {}},
-        {'name': 'Каталог', 'endpoint': 'catalog.catalog_index', 'params': {}},
-        {'name': category_name, 'endpoint': 'catalog.subcategory', 'params': {'category_slug': category_slug}},
-        {'name': subcategory_name, 'endpoint': None, 'params': {}},
-    ]
+    # Главные фото всех товаров страницы одним запросом
+    main_images = product_service.get_main_images(product_ids=[p.id for p in pagination.items])
+    # Количество товаров для каждого варианта фильтров
+    facets = product_service.get_subcategory_facets(subcat_slug=subcategory_slug)
     return render_template(
         'catalog/products.html',
         pagination=pagination,
+        cursor_mode=bool(cursor),
+        next_cursor=next_cursor,
+        main_images=main_images,
+        facets=facets,
+        filters=filters,
+        filter_args=filters.to_args(),
         subcategory_slug=subcategory_slug,
         favorite_ids=favorite_ids,
-        breadcrumbs=breadcrumbs,
-        title=subcategory_name
+        breadcrumbs=subcategory.breadcrumbs,
+        title=subcategory.name
     )
 
 @catalog.route('/product/<product_slug>')
+@cache_anonymous_page
 def product(product_slug):
     product_service = ProductService(db)
     cart_service = CartService(db)
 
-    # Получаем карточку продукта и его предыдущую стоимость
-    product_card = product_service.get_product_by_slug(product_slug=product_slug)
+    # Получаем карточку продукта вместе с фото
+    product_card = product_service.get_product_card(product_slug=product_slug)
+    if not product_card:
+        abort(404)
 
     if current_user.is_authenticated:
         favorite_ids = cart_service.get_favorites_ids(user_id=current_user.get_id())
@@ -110,29 +135,45 @@ def product(product_slug):
         favorite_items = session.get('favorite', [])
         favorite_ids = [int(item['product_id']) for item in favorite_items]
 
-    category = product_service.get_category_by_product_slug(product_slug=product_slug)
-    category_slug = category.slug
-    category_name = category.name
+    # Путь до подкатегории берем из дерева каталога в памяти
+    tree = product_service.get_catalog_tree()
+    subcategory = tree.subcategory_by_id(product_card.subcategory_id)
 
-    subcategory = product_service.get_subcategory_by_product_slug(product_slug=product_slug)
-    subcategory_slug = subcategory.slug
-    subcategory_name = subcategory.name
+    # Страница зависит от времени изменения товара, дерева каталога (хлебные крошки),
+    # версии шаблонов и статики и от состояния посетителя (корзина, избранное).
+    # Если браузер прислал актуальный ETag - отвечаем 304 без рендеринга
+    g.page_version = ('product', product_card.id, product_card.updated_at, build_version(), tree.version)
+    etag = make_etag(g.page_version, viewer_state(cart_len=get_cart_len(db), favorite_ids=favorite_ids))
+    if is_not_modified(etag=etag):
+        return not_modified_response(etag=etag, private=True)
 
-    product_name = product_service.get_product_by_slug(product_slug=product_slug).name
     breadcrumbs = [
-        {'name': 'DNS', 'endpoint': 'header.index', 'params': {}},
-        {'name': 'Каталог', 'endpoint': 'catalog.catalog_index', 'params': {}},
-        {'name': category_name, 'endpoint': 'catalog.subcategory', 'params': {'category_slug': category_slug}},
-        {'name': subcategory_name, 'endpoint': 'catalog.products', 'params': {'subcategory_slug': subcategory_slug}},
-        {'name': product_name, 'endpoint': None, 'params': {}},
+        *(subcategory.trail if subcategory else []),
+        {'name': product_card.name, 'endpoint': None, 'params': {}},
     ]
 
-    return render_template(
+    response = make_response(render_template(
         'catalog/product.html',
         product=product_card,
         favorite_ids=favorite_ids,
         breadcrumbs=breadcrumbs,
-    )
+    ))
+    return set_validators(response, etag=etag, private=True)
+
+@catalog.route('/img/<int:width>x<int:height>/<path:filename>')
+def resized_image(width, height, filename):
+    """Изображение каталога, вписанное в рамку width x height (0 - без ограничения).
+    filename - путь относительно папки static каталога, например images/products/.../main.jpg.
+    Уменьшенная копия создается при первом запросе и хранится в дисковом кэше"""
+    path = resized_image_path(filename, width, height)
+    if path is None:
+        abort(404)
+
+    response = offload_file_response(path) or send_file(path, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.max_age = 24 * 60 * 60
+    response.cache_control.no_cache = None
+    return response
 
 @catalog.route('/product_sort/<subcategory_slug>')
 def product_sort(subcategory_slug):
@@ -143,27 +184,58 @@ def product_sort(subcategory_slug):
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 8, type=int)
 
+    cursor = request.args.get('cursor')
+    filters = ProductFilters.from_args(request.args)
+
     valid_sort = {'price': Product.price, 'name': Product.name}
-    order_field = valid_sort.get(sort_by, Product.name)
+    if sort_by not in valid_sort:
+        sort_by = 'name'
+    order_field = valid_sort[sort_by]
 
-    # Выбираем направление сортировки
+    # Выбираем направление сортировки (id - для однозначного порядка при равных значениях)
     if order_direction.lower() == 'desc':
-        order_field = desc(order_field)
+        direction = 'desc'
+        order_field = (desc(order_field), desc(Product.id))
+    else:
+        direction = 'asc'
+        order_field = (asc(order_field), asc(Product.id))
+
+    # Валидатор списка: время последнего изменения товаров и их количество (один агрегирующий запрос)
+    # и версия статики (в JSON - URL фото с хэшем). Last-Modified не отдается: по одному
+    # времени изменения нельзя заметить удаление товара
+    last_modified, count = product_service.get_products_version(subcat_slug=subcategory_slug, filters=filters)
+    etag = make_etag('product_sort', request.full_path, last_modified, count, build_version())
+    if is_not_modified(etag=etag):
+        return not_modified_response(etag=etag)
+
+    if cursor:
+        # Keyset-пагинация: страница после курсора, без OFFSET и COUNT(*)
+        pagination = product_service.get_products_by_subcategory_cursor(
+            subcat_slug=subcategory_slug,
+            sort_by=sort_by,
+            direction=direction,
+            cursor=cursor,
+            per_page=per_page,
+            filters=filters
+        )
     else:
-        order_field = asc(order_field)
+        pagination = product_service.get_products_by_subcategory_slug(
+            subcat_slug=subcategory_slug,
+            page=page,
+            per_page=per_page,
+            order=order_field,
+            filters=filters
+        )
 
-    pagination = product_service.get_products_by_subcategory_slug(
-        subcat_slug=subcategory_slug,
-        page=page,
-        per_page=per_page,
-        order=order_field
-    )
+    # Главные фото всех товаров страницы одним запросом
+    main_images = product_service.get_main_images(product_ids=[p.id for p in pagination.items])
 
     result = []
     for p in pagination.items:
-        # Строим полный URL к изображению
-        image_filename = f"images/{product_service.get_main_image(product_id=p.id).image_path}"
-        image_url = url_for('catalog.static', filename=image_filename)
+        # Строим URL к уменьшенной копии главного фото (или к заглушке)
+        main_image = main_images.get(p.id)
+        image_path = main_image.image_path if main_image else None
+        variants = main_image.variants if main_image else None
         result.append({
             'id': p.id,
             'category_id': p.category_id,
@@ -177,16 +249,29 @@ def product_sort(subcategory_slug):
             'updated_at': p.updated_at,
             'sku': p.sku,
             'weight': p.weight,
-            'image_url': image_url
+            'image_url': image_url(image_path, variants, 'card'),
+            'image_srcset': image_srcset(image_path, variants, 'jpeg'),
         })
-    return jsonify({
+    if cursor:
+        response = jsonify({
+            'products': result,
+            'has_next': pagination.has_next,
+            'next_cursor': pagination.next_cursor,
+        })
+        return set_validators(response, etag=etag)
+
+    next_cursor = encode_cursor(sort_by=sort_by, direction=direction, product=pagination.items[-1]) \
+        if pagination.has_next else None
+    response = jsonify({
         'products': result,
         'has_prev': pagination.has_prev,
         'has_next': pagination.has_next,
+        'next_cursor': next_cursor,
         'page': pagination.page,
         'pages': pagination.pages,
         'total': pagination.total
     })
+    return set_validators(response, etag=etag)
 
 
 @catalog.route('/add_to_cart/<int:product_id>', methods=['POST'])
@@ -238,22 +323,12 @@ def cart():
     if current_user.is_authenticated:
         cart_service = CartService(db)
         cart_items = cart_service.get_cart_items(user_id = current_user.get_id())
+        # Главные фото товаров корзины одним запросом
+        main_images = ProductService(db).get_main_images(
+            product_ids=[item.product_id for item in cart_items])
     else:
-        # Извлекаем корзину из сессии (список словарей)
-        cart_data = session.get('cart', [])
-        cart_items = []
-        # Для каждого item получаем объект продукта
-        # и создаем динамический класс CartItem на лету
-        for item in cart_data:
-            product = db.session.get(Product, item['product_id'])
-            if product:
-                cart_items.append(
-                    type('CartItem', (), { # Создаем мета класс с именем 'CartItem'
-                        'product_id': item['product_id'],
-                        'quantity': item['quantity'],
-                        'products': product
-                    })() # () - создаем экземпляр класса
-                )
+        # Извлекаем корзину из сессии (список словарей), товары с главными фото - одним запросом
+        cart_items, main_images = get_guest_cart_items(db, cart_data=session.get('cart', []))
 
     # Количество товаров в корзине
     cart_quantity = sum(item.quantity for item in cart_items)
@@ -262,6 +337,7 @@ def cart():
     return render_template(
         'catalog/cart.html',
         cart_items=cart_items,
+        main_images=main_images,
         cart_quantity=cart_quantity,
         cart_total=cart_total,
     )
@@ -273,26 +349,17 @@ def favorite():
         cart_service = CartService(db)
         favorite_items = cart_service.get_favorites(user_id=current_user.get_id())
         favorite_ids = cart_service.get_favorites_ids(user_id=current_user.get_id())
+        # Главные фото товаров одним запросом
+        main_images = ProductService(db).get_main_images(product_ids=favorite_ids)
     else:
-        # Извлекаем избранное из сессии (список словарей)
-        favorite_data = session.get('favorite', [])
-        favorite_items = []
-        # Для каждого item получаем объект продукта
-        # и создаем динамический класс Favorite на лету
-        for item in favorite_data:
-            product = db.session.get(Product, item['product_id'])
-            if product:
-                favorite_items.append(
-                    type('Favorite', (), { # Создаем мета класс с именем 'Favorite'
-                        'product_id': item['product_id'],
-                        'products': product
-                    })() # () - создаем экземпляр класса
-                )
+        # Извлекаем избранное из сессии (список словарей), товары с главными фото - одним запросом
+        favorite_items, main_images = get_guest_favorites(db, favorite_data=session.get('favorite', []))
         favorite_ids = [favorite.product_id for favorite in favorite_items]
 
     return render_template(
         'catalog/favorite.html',
         favorite_items=favorite_items,
+        main_images=main_images,
         favorite_ids = favorite_ids
     )
 
@@ -384,9 +451,13 @@ def orders():
     """Отображает страницу со всеми заказами пользователя"""
     cart_service = CartService(db)
     orders_list = cart_service.get_orders_by_user_id(user_id=current_user.get_id())
+    # Главные фото всех товаров из заказов одним запросом
+    main_images = ProductService(db).get_main_images(
+        product_ids=[item.product_id for order in orders_list for item in order.order_item])
     return render_template(
         'catalog/orders.html',
-        orders=orders_list
+        orders=orders_list,
+        main_images=main_images,
     )
 
 @catalog.route('/order/buy_order/<int:order_id>', methods=['GET', 'POST'])
@@ -1,5 +1,5 @@
 from flask import (Blueprint, request, redirect, url_for, flash,
-                   render_template, make_response, session)
+                   render_template, make_response, session, jsonify)
 from flask_login import (login_user, login_required,
                          logout_user, current_user)
 from werkzeug.security import check_password_hash
@@ -7,7 +7,8 @@ from werkzeug.security import check_password_hash
 from extensions import db
 from forms import RegisterForm, LoginForm, EditProfileForm
 from services import (UserService, ProductService, transfer_guest_cart_to_user,
-                      transfer_guest_favorite_to_user, CartService)
+                      transfer_guest_favorite_to_user, prepare_avatar,
+                      make_etag, is_not_modified, set_validators, not_modified_response)
 from services.UserLogin import UserLogin
 
 
@@ -23,14 +24,15 @@ header = Blueprint(
 @header.route('/')
 def index():
     product_service = ProductService(db)
-    cart_service = CartService(db)
     random_products = product_service.get_random_products()
+    # Главные фото товаров одним запросом
+    main_images = product_service.get_main_images(product_ids=[p.id for p in random_products])
 
-    cart_len = len(cart_service.get_cart_items(user_id=current_user.get_id()))
+    # cart_len подставляет контекстный процессор
     return render_template(
         "header/base.html",
         random_products=random_products,
-        cart_len=cart_len
+        main_images=main_images,
     )
 
 @header.route('/register', methods=['GET', 'POST'])
@@ -133,14 +135,21 @@ def delete_profile():
 @header.route('/userava')
 @login_required
 def userava():
-    """Функция отображения аватарки пользователя"""
+    """Функция отображения аватарки пользователя.
+    Браузер хранит аватар и проверяет его по ETag - изображение читается из БД,
+    только если аватар изменился"""
+    version = current_user.getAvatarVersion()
+    etag = make_etag(current_user.get_id(), version)
+    if is_not_modified(etag=etag, last_modified=version):
+        return not_modified_response(etag=etag, last_modified=version, private=True)
+
     img = current_user.getAvatar(header)
     if not img:
         return ""
 
     h = make_response(img)
     h.headers['Content-Type'] = "image/png"
-    return h
+    return set_validators(h, etag=etag, last_modified=version, private=True)
 
 @header.route('/upload', methods=['GET', 'POST'])
 @login_required
@@ -151,7 +160,8 @@ def upload():
         if file and current_user.verifyExt(file.filename):
             try:
                 user_service = UserService(db)
-                img = file.read()
+                # Уменьшаем изображение до размера аватара
+                img = prepare_avatar(file.read())
                 result = user_service.update_avatar(user_id = current_user.get_id(), avatar = img)
                 if result:
                     flash("Аватар обновлен", category="success")
@@ -168,6 +178,7 @@ def upload():
 def search():
     product_service = ProductService(db)
     query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
 
     if not query:
         flash("Поисковый запрос пустой", "warning")
@@ -178,9 +189,29 @@ def search():
     if '%' in query or '_' in query:
         query = query.replace('%', '').replace('_', '')
 
-    products = product_service.product_search(string=query)
+    pagination = product_service.product_search(string=query, page=page)
+    main_images = product_service.get_main_images(product_ids=[p.id for p in pagination.items])
     return render_template(
         'header/search.html',
-        products=products,
+        products=pagination.items,
+        pagination=pagination,
+        main_images=main_images,
         query=query
-    )
\ No newline at end of file
+    )
+
+@header.route('search/suggest')
+def search_suggest():
+    """Подсказки для поисковой строки (JSON) - подкатегории и товары по началу слова"""
+    product_service = ProductService(db)
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 10, type=int)
+
+    if len(query) < 2 or len(query) > 100:
+        return jsonify({'suggestions': []})
+
+    suggestions = []
+    for kind, name, slug in product_service.get_search_suggestions(prefix=query, limit=limit):
+        url = url_for('catalog.products', subcategory_slug=slug) if kind == 'subcategory' \
+            else url_for('catalog.product', product_slug=slug)
+        suggestions.append({'type': kind, 'name': name, 'url': url})
+    return jsonify({'suggestions': suggestions})
@@ -1,5 +1,6 @@
 from flask import url_for
-from sqlalchemy.orm import relationship
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 
 from extensions import db
 
@@ -13,7 +14,9 @@ class User(db.Model):
     email = db.Column(db.Text, nullable=False, unique=True)
     phone = db.Column(db.String, nullable=True, unique=True)
     psw = db.Column(db.Text, nullable=False)
-    avatar = db.Column(db.LargeBinary, default=None)
+    # Изображение загружается из БД только при обращении к атрибуту (не при каждой загрузке пользователя)
+    avatar = deferred(db.Column(db.LargeBinary, default=None))
+    avatar_updated_at = db.Column(db.DateTime(timezone=True), nullable=True) # Время загрузки аватара (для ETag)
     time = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
     is_active = db.Column(db.Boolean, nullable=False, default=True)
 
@@ -29,8 +32,12 @@ class Category(db.Model):
     name = db.Column(db.Text, nullable=False)
     slug = db.Column(db.Text, nullable=False, unique=True, index=True)
     picture = db.Column(db.Text, nullable=False)
+    picture_variants = db.Column(db.JSON, nullable=True) # Размеры уменьшенных копий фото
 
-    subcategory = relationship("SubCategory", back_populates="category", cascade="all, delete-orphan")
+    subcategory = relationship("SubCategory",
+                               back_populates="category",
+                               order_by="SubCategory.id",
+                               cascade="all, delete-orphan")
     products = relationship("Product", back_populates="category", cascade="all, delete-orphan")
 
     def get_absolute_url(self):
@@ -45,16 +52,31 @@ class SubCategory(db.Model):
     name = db.Column(db.Text, nullable=False)
     slug = db.Column(db.Text, nullable=False, unique=True, index=True)
     picture = db.Column(db.Text, nullable=False)
+    picture_variants = db.Column(db.JSON, nullable=True) # Размеры уменьшенных копий фото
 
     category = relationship("Category", back_populates="subcategory")
-    products = relationship("Product", back_populates="subcategory", cascade="all, delete-orphan")
+    products = relationship("Product",
+                            back_populates="subcategory",
+                            order_by="Product.id",
+                            cascade="all, delete-orphan")
 
     def get_absolute_url(self):
         return url_for('catalog.products', subcategory_slug=self.slug)
 
 
+# Выражение для полнотекстового поиска по товару (русская морфология):
+# совпадения в названии и артикуле важнее, чем в описании
+PRODUCT_SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce(name, '') || ' ' || coalesce(sku, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'B')"
+)
+
+
 class Product(db.Model):
     __tablename__ = "products"
+    __table_args__ = (
+        db.Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     category_id = db.Column(db.Integer, db.ForeignKey("categories.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -68,6 +90,8 @@ class Product(db.Model):
     updated_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), onupdate=db.func.now()) # Дата посл. обновления
     sku = db.Column(db.String, nullable=True) # Артикул товара
     weight = db.Column(db.Float, nullable=True) # Вес товара
+    latest_price = db.Column(db.Float, nullable=True) # Последняя предыдущая цена (из ProductPrice)
+    search_vector = deferred(db.Column(TSVECTOR, db.Computed(PRODUCT_SEARCH_VECTOR, persisted=True))) # Для поиска
 
     cart_item = relationship("CartItem", back_populates="products")
     favorite = relationship("Favorite", back_populates="products")
@@ -81,13 +105,6 @@ class Product(db.Model):
     category = relationship("Category", back_populates="products")
     subcategory = relationship("SubCategory", back_populates="products")
 
-    @property
-    def latest_price(self):
-        """Последня цена или none"""
-        if self.old_price:
-            return max(self.old_price, key=lambda p: p.created_at)
-        return None
-
     def get_absolute_url(self):
         return url_for('catalog.product', product_slug=self.slug)
 
@@ -99,6 +116,7 @@ class ProductImage(db.Model):
     image_path = db.Column(db.String(255), nullable=False)
     sort_order = db.Column(db.Integer, default=False) # Порядок отображения
     is_main = db.Column(db.Boolean, default=False) # Главное фото
+    variants = db.Column(db.JSON, nullable=True) # Размеры уменьшенных копий {размер: [ширина, высота]}
     created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
 
     product = relationship("Product", back_populates="images")
@@ -117,6 +135,10 @@ class ProductPrice(db.Model):
 class CartItem(db.Model):
     """Корзина товаров"""
     __tablename__ = "cart_items"
+    __table_args__ = (
+        # Одна позиция на товар - на ограничение опирается INSERT ... ON CONFLICT в CartService
+        db.UniqueConstraint("user_id", "product_id", name="uq_cart_items_user_id_product_id"),
+    )
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
@@ -1,13 +1,43 @@
-from flask import url_for
+import os
+import logging
+import threading
+
 from flask_login import UserMixin
 
+from extensions import db
 from services import UserService
 
 
+logger = logging.getLogger(__name__)
+
+
+class DefaultAvatar:
+    """Аватар по умолчанию: читается с диска один раз и хранится в памяти"""
+    def __init__(self, filename=os.path.join('static', 'images', 'default.png')):
+        self.filename = filename
+        self._image = None
+        self._lock = threading.Lock()
+
+    def get(self, app):
+        if self._image is None:
+            with self._lock:
+                if self._image is None:
+                    try:
+                        with app.open_resource(self.filename, 'rb') as f:
+                            self._image = f.read()
+                    except FileNotFoundError as e:
+                        logger.error("Не найден аватар по умолчанию: " + str(e))
+                        return None
+        return self._image
+
+
+default_avatar = DefaultAvatar()
+
+
 class UserLogin(UserMixin):
     def fromDB(self, db, user_id):
         user_service = UserService(db)
-        self.__user = user_service.get_user_by_id(user_id=user_id)
+        self.__user = user_service.get_user_identity(user_id=user_id)
         if self.__user:
             return self
         else:
@@ -32,18 +62,16 @@ class UserLogin(UserMixin):
     def getPhone(self):
         return self.__user.phone if self.__user else "Номер не известен"
 
-    def getAvatar(self, app):
-        img = None
-        if not self.__user.avatar:
-            try:
-                with app.open_resource(app.root_path + url_for('static', filename="images/default.png"), 'rb') as f:
-                    img = f.read()
-            except FileNotFoundError as e:
-                print("Не найден аватар по умолчанию: " + str(e))
-        else:
-            img = self.__user.avatar
+    def getAvatarVersion(self):
+        """Время загрузки аватара (None - используется аватар по умолчанию)"""
+        return self.__user.avatar_updated_at if self.__user else None
 
-        return img
+    def getAvatar(self, app):
+        if not self.getAvatarVersion():
+            return default_avatar.get(app)
+        # Изображение загружается из БД только здесь (в данных пользователя его нет)
+        avatar = UserService(db).get_avatar(user_id=self.__user.id)
+        return avatar or default_avatar.get(app)
 
     def verifyExt(self, filename):
         ext = filename.split('.', 1)[-1]
@@ -1,5 +1,13 @@
 from .url_creator import DATABASE_URL_FOR_FLASK, db_main, db_new
 from .db_functions import UserService, ProductService, CartService, AdminService
+from .pagination import PRODUCT_SORT_COLUMNS, encode_cursor
+from .facets import ProductFilters
+from .page_cache import cache_anonymous_page
+from .images import create_derivatives, delete_derivatives, image_url, image_srcset, prepare_avatar
+from .image_cache import resized_image_path
+from .static_assets import offload_file_response
+from .http_cache import build_version, make_etag, viewer_state, is_not_modified, set_validators, not_modified_response
 from .functions import (create_path_for_file, add_product_to_cart,
                         transfer_guest_cart_to_user, transfer_guest_favorite_to_user,
-                        create_inject_cart_len, build_admin_orders_sort_column)
\ No newline at end of file
+                        create_inject_cart_len, get_cart_len, get_guest_cart_items,
+                        get_guest_favorites, build_admin_orders_sort_column)
\ No newline at end of file
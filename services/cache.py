@@ -0,0 +1,262 @@
+"""Кэши данных каталога и пользователей, хранящиеся в памяти процесса"""
+import os
+import time
+import hashlib
+import random
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+
+# Начало хлебных крошек всех страниц каталога
+CATALOG_BREADCRUMBS = (
+    {'name': 'DNS', 'endpoint': 'header.index', 'params': {}},
+    {'name': 'Каталог', 'endpoint': 'catalog.catalog_index', 'params': {}},
+)
+# Сколько секунд хранятся данные пользователя и сколько пользователей хранится
+USER_CACHE_TTL = 60
+USER_CACHE_SIZE = 1000
+# Как часто (в секундах) проверяется отметка изменения каталога другими процессами
+CHANGE_STAMP_CHECK_INTERVAL = 1
+
+
+class MemoryCache:
+    """Простой потокобезопасный кэш ключ-значение"""
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TTLCache:
+    """Потокобезопасный кэш ключ-значение с временем жизни записей
+    и ограничением количества (вытесняются давно запрошенные)"""
+    def __init__(self, *, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            expires, value = item
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class IdPool:
+    """Набор id, из которого выбираются случайные элементы (обновляется целиком)"""
+    def __init__(self):
+        self._ids = ()
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def refresh(self, ids):
+        with self._lock:
+            self._ids = tuple(ids)
+            self._loaded = True
+
+    def sample(self, count):
+        ids = self._ids
+        return random.sample(ids, min(count, len(ids)))
+
+
+class ChangeStamp:
+    """Отметка изменения в виде файла: процесс, изменивший данные, обновляет время
+    изменения файла, а остальные процессы (воркеры сервера) по нему сбрасывают свои кэши.
+    Нужна для изменений вне процесса сервера, например команды flask regenerate-images"""
+    def __init__(self, check_interval=CHANGE_STAMP_CHECK_INTERVAL):
+        self.path = None
+        self.check_interval = check_interval
+        self._seen = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def init(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._seen = self._mtime()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def touch(self):
+        """Сообщает другим процессам об изменении"""
+        if not self.path:
+            return
+        with open(self.path, 'a'):
+            pass
+        os.utime(self.path)
+        with self._lock:
+            self._seen = self._mtime()
+
+    def changed(self):
+        """True, если отметку обновил другой процесс (файл проверяется не чаще раза в check_interval)"""
+        if not self.path:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.check_interval:
+                return False
+            self._checked_at = now
+            mtime = self._mtime()
+            if mtime == self._seen:
+                return False
+            self._seen = mtime
+            return True
+
+
+@dataclass(eq=False)
+class CatalogNode:
+    """Категория или подкатегория в дереве каталога (не привязана к сессии БД)"""
+    id: int
+    name: str
+    slug: str
+    picture: str | None
+    picture_variants: dict | None = None
+    # Для подкатегории - родительская категория
+    category: 'CatalogNode | None' = None
+    subcategories: list = field(default_factory=list)
+    # Хлебные крошки страницы узла (последний элемент без ссылки)
+    breadcrumbs: list = field(default_factory=list)
+    # Хлебные крошки вложенных страниц (все элементы со ссылками)
+    trail: list = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class UserIdentity:
+    """Данные пользователя для current_user (без аватара, не привязаны к сессии БД)"""
+    id: int
+    surname: str
+    name: str
+    email: str
+    phone: str | None
+    is_active: bool
+    avatar_updated_at: datetime | None
+
+
+class CatalogTree:
+    """Дерево категорий и подкатегорий с поиском по slug и id
+    и заранее построенными хлебными крошками"""
+    def __init__(self):
+        self._categories = {}
+        self._subcategories = {}
+        self._subcategories_by_id = {}
+        self._lock = threading.Lock()
+        self.ready = False
+        # Номер сброса: увеличивается в invalidate()
+        self.generation = 0
+        # Хэш содержимого дерева (одинаков во всех процессах, входит в ETag страниц)
+        self.version = None
+
+    def build(self, categories, *, generation=None):
+        """Строит дерево по списку категорий с загруженными подкатегориями.
+        generation - значение self.generation до чтения категорий из БД: если за это время
+        дерево было сброшено, данные могли устареть и дерево остается неготовым"""
+        by_slug, sub_by_slug, sub_by_id = {}, {}, {}
+        digest = hashlib.sha1()
+        for category in categories:
+            node = CatalogNode(id=category.id, name=category.name, slug=category.slug,
+                               picture=category.picture, picture_variants=category.picture_variants)
+            link = {'name': node.name, 'endpoint': 'catalog.subcategory',
+                    'params': {'category_slug': node.slug}}
+            node.trail = [*CATALOG_BREADCRUMBS, link]
+            node.breadcrumbs = [*CATALOG_BREADCRUMBS, {'name': node.name, 'endpoint': None, 'params': {}}]
+            by_slug[node.slug] = node
+
+            for subcategory in category.subcategory:
+                child = CatalogNode(id=subcategory.id, name=subcategory.name, slug=subcategory.slug,
+                                    picture=subcategory.picture, picture_variants=subcategory.picture_variants,
+                                    category=node)
+                link = {'name': child.name, 'endpoint': 'catalog.products',
+                        'params': {'subcategory_slug': child.slug}}
+                child.trail = [*node.trail, link]
+                child.breadcrumbs = [*node.trail, {'name': child.name, 'endpoint': None, 'params': {}}]
+                node.subcategories.append(child)
+                sub_by_slug[child.slug] = child
+                sub_by_id[child.id] = child
+
+            for item in (node, *node.subcategories):
+                digest.update(repr((item.id, item.name, item.slug, item.picture,
+                                    item.picture_variants)).encode('utf-8'))
+
+        with self._lock:
+            self._categories = by_slug
+            self._subcategories = sub_by_slug
+            self._subcategories_by_id = sub_by_id
+            self.version = digest.hexdigest()
+            self.ready = generation is None or generation == self.generation
+
+    def invalidate(self):
+        """Помечает дерево устаревшим (будет перестроено при следующем обращении)"""
+        with self._lock:
+            self.generation += 1
+            self.ready = False
+
+    def category(self, slug):
+        return self._categories.get(slug)
+
+    def subcategory(self, slug):
+        return self._subcategories.get(slug)
+
+    def subcategory_by_id(self, subcategory_id):
+        return self._subcategories_by_id.get(subcategory_id)
+
+
+# Количество товаров в подкатегориях: {slug подкатегории: количество}
+subcategory_counts = MemoryCache()
+
+# Сводка фасетов подкатегорий: {slug подкатегории: количество товаров по вариантам фильтров}
+facet_summaries = MemoryCache()
+
+# Дерево категорий для навигации по каталогу
+catalog_tree = CatalogTree()
+
+# id товаров в наличии для блока случайных товаров на главной странице
+featured_product_ids = IdPool()
+
+# Отметка изменения каталога, общая для всех процессов
+catalog_stamp = ChangeStamp()
+
+# Данные пользователей для загрузки current_user: {id пользователя: UserIdentity}
+user_identities = TTLCache(ttl=USER_CACHE_TTL, max_entries=USER_CACHE_SIZE)
@@ -0,0 +1,154 @@
+"""WSGI-прослойка для сжатия ответов (gzip, а также brotli, если установлен пакет brotli)"""
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Типы содержимого, которые имеет смысл сжимать (изображения уже сжаты)
+COMPRESSIBLE_MIMETYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+# Ответы меньше этого размера (байт) не сжимаются - выигрыш меньше накладных расходов
+COMPRESS_MIN_SIZE = 500
+
+
+class GzipCompressor:
+    def __init__(self, level):
+        # wbits=16+MAX_WBITS - формат gzip (с заголовком и контрольной суммой)
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data, flush=False):
+        result = self._compressor.compress(data)
+        if flush:
+            result += self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        return result
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliCompressor:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data, flush=False):
+        result = self._compressor.process(data)
+        if flush:
+            result += self._compressor.flush()
+        return result
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """Сжимает ответы приложения, если клиент это поддерживает.
+    Ответы с Content-Length сжимаются целиком, потоковые - по частям
+    (каждая часть сразу отправляется клиенту)"""
+    def __init__(self, app, *, level=6, brotli_quality=5, min_size=COMPRESS_MIN_SIZE,
+                 mimetypes=COMPRESSIBLE_MIMETYPES):
+        self.app = app
+        self.level = level
+        self.brotli_quality = brotli_quality
+        self.min_size = min_size
+        self.mimetypes = set(mimetypes)
+
+    def __call__(self, environ, start_response):
+        encoding = self._choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None or environ.get('REQUEST_METHOD') == 'HEAD':
+            return self.app(environ, start_response)
+
+        # Запоминаем статус и заголовки, чтобы решить, сжимать ли ответ.
+        # Flask вызывает start_response до того, как вернуть тело ответа
+        captured = []
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return lambda data: None
+
+        app_iter = self.app(environ, capture_start_response)
+        status, headers, exc_info = captured
+
+        if not self._should_compress(status, headers):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        streamed = not any(name.lower() == 'content-length' for name, _ in headers)
+        start_response(status, self._compressed_headers(headers, encoding), exc_info)
+        return self._compress(app_iter, encoding, streamed)
+
+    def _choose_encoding(self, accept_encoding):
+        accepted = parse_accept_header(accept_encoding)
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def _should_compress(self, status, headers):
+        code = int(status.split(' ', 1)[0])
+        if code < 200 or code in (204, 206, 304):
+            return False
+
+        header_map = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in header_map or 'no-transform' in header_map.get('cache-control', ''):
+            return False
+        mimetype = header_map.get('content-type', '').split(';', 1)[0].strip().lower()
+        if mimetype not in self.mimetypes:
+            return False
+        length = header_map.get('content-length')
+        return length is None or int(length) >= self.min_size
+
+    def _compressed_headers(self, headers, encoding):
+        result = []
+        vary = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                # Сжатое тело отличается побайтно - строгий ETag становится слабым
+                value = 'W/' + value
+            if lower == 'vary':
+                vary = value
+                continue
+            result.append((name, value))
+
+        if vary is None:
+            vary = 'Accept-Encoding'
+        elif 'accept-encoding' not in vary.lower():
+            vary = f"{vary}, Accept-Encoding"
+        result.append(('Vary', vary))
+        result.append(('Content-Encoding', encoding))
+        return result
+
+    def _compress(self, app_iter, encoding, streamed):
+        if encoding == 'br':
+            compressor = BrotliCompressor(self.brotli_quality)
+        else:
+            compressor = GzipCompressor(self.level)
+        try:
+            for chunk in app_iter:
+                if not chunk:
+                    continue
+                data = compressor.compress(chunk, flush=streamed)
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            close = getattr(app_iter, 'close', None)
+            if close is not None:
+                close()
@@ -1,5 +1,7 @@
-from flask import flash
-from sqlalchemy import select, func
+from flask import flash, current_app, g
+from sqlalchemy import select, update, delete, func, tuple_, and_, literal
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import joinedload, selectinload, load_only
 from sqlalchemy.exc import IntegrityError
 from psycopg2.errors import UniqueViolation
 from werkzeug.security import generate_password_hash
@@ -9,6 +11,15 @@ from datetime import datetime, timedelta
 
 from models import (User, Category, SubCategory, Product, CartItem, Favorite,
                     Order, OrderItem, ProductImage, ProductPrice)
+from .pagination import (PRODUCT_SORT_COLUMNS, CursorPage, ListPagination,
+                         MAX_PER_PAGE, encode_cursor, decode_cursor)
+from .cache import (subcategory_counts, featured_product_ids, facet_summaries, catalog_tree,
+                    catalog_stamp, user_identities, UserIdentity)
+from .facets import (PRICE_BUCKETS, WEIGHT_BUCKETS, ProductFilters,
+                     range_condition, sku_prefix)
+from .search_index import product_search_index
+from .suggest_index import suggest_index, SUGGEST_LIMIT
+from .page_cache import page_cache
 
 
 logger = logging.getLogger(__name__)
@@ -67,6 +78,37 @@ class UserService:
 
         return False
 
+    def get_user_identity(self, *, user_id):
+        """Данные пользователя для current_user (без аватара).
+        Хранятся в кэше USER_CACHE_TTL секунд - не нужно читать БД при каждом запросе"""
+        user_id = int(user_id)
+        identity = user_identities.get(user_id)
+        if identity is not None:
+            return identity
+
+        row = self.db.session.execute(
+            select(User.id, User.surname, User.name, User.email, User.phone,
+                   User.is_active, User.avatar_updated_at)
+            .where(User.id == user_id)
+        ).first()
+        if not row:
+            logger.warning("Пользователь не найден")
+            return False
+        identity = UserIdentity(**row._asdict())
+        user_identities.set(user_id, identity)
+        return identity
+
+    @staticmethod
+    def forget_user(*, user_id):
+        """Удаляет данные пользователя из кэша (вызывается после их изменения)"""
+        user_identities.delete(int(user_id))
+
+    def get_avatar(self, *, user_id):
+        """Изображение аватара пользователя (None - аватар не загружен)"""
+        return self.db.session.execute(
+            select(User.avatar).where(User.id == user_id)
+        ).scalar()
+
     def get_user(self, *, form):
         """Функция для входа - возвращает пользователя по email или номеру телефона если профиль не удален"""
         login_type = form.login_type.data
@@ -99,7 +141,9 @@ class UserService:
                 logger.warning("Пользователь не найден")
                 return False
             user.avatar = avatar
+            user.avatar_updated_at = func.now()
             self.db.session.commit()
+            self.forget_user(user_id=user_id)
         except Exception as e:
             logger.error("Ошибка обновления аватара в БД " + str(e))
             return False
@@ -123,6 +167,7 @@ class UserService:
         ).scalars().first()
         user.phone = user_phone
         self.db.session.commit()
+        self.forget_user(user_id=user_id)
         logger.info(f"Телефон {user_phone} обновлен для пользователя {user.surname} {user.name}")
 
     def edit_profile(self, *, user_id, form):
@@ -150,6 +195,7 @@ class UserService:
         user.email = form.email.data
         user.phone = form.phone.data
         self.db.session.commit()
+        self.forget_user(user_id=user_id)
         logger.info(f"Данные обновлены. Пользователь: {user_id}, фамилия: {form.surname.data}, "
                     f"имя: {form.name.data}, email: {form.email.data}, телефон: {form.phone.data}")
         flash("Данные сохранены", category="success")
@@ -161,6 +207,7 @@ class UserService:
         ).scalars().first()
         user.is_active = False
         self.db.session.commit()
+        self.forget_user(user_id=user_id)
         logger.info(f"Профиль пользователя: {user_id} удален")
         flash("Ваш профиль успешно удален", category="success")
 
@@ -168,23 +215,51 @@ class ProductService:
     def __init__(self, db):
         self.db = db
 
+    def catalog_changed(self):
+        """Сбрасывает кэши, зависящие от состава каталога (вызывается после изменений в админ-панели),
+        и сообщает об изменении остальным процессам"""
+        self.clear_catalog_caches()
+        catalog_stamp.touch()
+
+    @staticmethod
+    def clear_catalog_caches():
+        """Сбрасывает кэши каталога в текущем процессе"""
+        subcategory_counts.clear()
+        facet_summaries.clear()
+        catalog_tree.invalidate()
+        suggest_index.invalidate()
+        page_cache.clear()
+
     """Категории"""
-    def get_category_list(self):
-        """Функция возвращает список всех категорий"""
-        try:
-            result = self.db.session.execute(
-                select(Category)
-                .order_by(Category.id)
+    def get_category_tree(self, *, with_products=False):
+        """Возвращает список категорий с загруженными подкатегориями
+        (и товарами подкатегорий, если with_products=True).
+        Подкатегории подгружаются JOIN-ом, товары - одним дополнительным запросом"""
+        load_subcategories = joinedload(Category.subcategory)
+        stmt = (
+            select(Category)
+            .options(load_subcategories)
+            .order_by(Category.id)
+        )
+        if with_products:
+            # Для списка товаров нужны только поля, которые выводятся в таблице
+            stmt = stmt.options(
+                load_subcategories
+                .selectinload(SubCategory.products)
+                .load_only(Product.id, Product.subcategory_id, Product.name, Product.slug,
+                           Product.price, Product.stock_quantity, Product.sku, Product.weight)
             )
-            categories = result.scalars()
-            if not categories:
-                logger.warning("Категории отсутствуют")
-                return False
-            return categories
-        except Exception as e:
-            logger.error("Ошибка получения данных из БД" + str(e))
-
-        return False
+        categories = self.db.session.execute(stmt).unique().scalars().all()
+        return categories
+
+    def get_catalog_tree(self):
+        """Возвращает дерево категорий из памяти процесса (строится одним запросом
+        при первом обращении и после изменения категорий)"""
+        if not catalog_tree.ready:
+            # Номер сброса читаем до запроса: сброс во время построения не будет потерян
+            generation = catalog_tree.generation
+            catalog_tree.build(self.get_category_tree(), generation=generation)
+        return catalog_tree
 
     def get_category_by_slug(self, *, cat_slug):
         """Возвращает категорию по ее slug"""
@@ -193,15 +268,6 @@ class ProductService:
         ).scalar()
         return category
 
-    def get_category_by_product_slug(self, *, product_slug):
-        """Возвращает категорию по slug продукта"""
-        category = self.db.session.execute(
-            select(Category)
-            .join(Product)
-            .where(Product.slug == product_slug)
-        ).scalar()
-        return category
-
     def get_category_by_subcategory_slug(self, *, subcat_slug):
         """Возвращает категорию по slug подкатегории"""
         category = self.db.session.execute(
@@ -233,7 +299,14 @@ class ProductService:
             )
         self.db.session.add(category)
         self.db.session.commit()
-        return True
+        self.catalog_changed()
+        return category
+
+    def set_picture_variants(self, *, category, variants):
+        """Сохраняет размеры уменьшенных копий фото категории или подкатегории"""
+        category.picture_variants = variants
+        self.db.session.commit()
+        self.catalog_changed()
 
     def edit_category(self, *, form, category):
         """Функция редактирует существующую категорию"""
@@ -248,6 +321,7 @@ class ProductService:
         if form.picture.data:
             category.picture = form.picture.data.filename
         self.db.session.commit()
+        self.catalog_changed()
         flash(message=message, category="success")
 
     def delete_category(self, *, cat_slug, object):
@@ -262,6 +336,7 @@ class ProductService:
 
         self.db.session.delete(category)
         self.db.session.commit()
+        self.catalog_changed()
         message = "Категория удалена!" if object is Category else "Подкатегория удалена!"
         flash(message=message, category="success")
 
@@ -269,16 +344,6 @@ class ProductService:
 
 
     """Подкатегории"""
-    def get_subcategories_by_category_slug(self, *, cat_slug):
-        """Возвращает список подкатегорий, по slug категории"""
-        subcategories = self.db.session.execute(
-            select(SubCategory)
-            .join(SubCategory.category)
-            .where(Category.slug == cat_slug)
-            .order_by(SubCategory.id)
-        ).scalars().all()
-        return subcategories
-
     def get_subcategory_by_slug(self, *, subcat_slug):
         """Возвращает подкатегорию по ее slug"""
         subcategory = self.db.session.execute(
@@ -286,15 +351,6 @@ class ProductService:
         ).scalar()
         return subcategory
 
-    def get_subcategory_by_product_slug(self, *, product_slug):
-        """Возвращает подкатегорию по slug продукта"""
-        subcategory = self.db.session.execute(
-            select(SubCategory)
-            .join(Product)
-            .where(Product.slug == product_slug)
-        ).scalar()
-        return subcategory
-
     """Товары"""
     def get_product_by_slug(self, *, product_slug):
         """Возвращает продукт по его slug"""
@@ -303,38 +359,177 @@ class ProductService:
         ).scalar()
         return product
 
+    def get_product_card(self, *, product_slug):
+        """Возвращает продукт по его slug вместе с фото (для карточки товара).
+        Категория и подкатегория для breadcrumbs берутся из дерева каталога"""
+        product = self.db.session.execute(
+            select(Product)
+            .options(selectinload(Product.images))
+            .where(Product.slug == product_slug)
+        ).scalar()
+        return product
 
     def get_products_by_subcategory_slug(self, *,
                                          subcat_slug,
                                          order=None,
                                          page=1,
                                          per_page=8,
+                                         filters=None,
                                          ):
         """Возвращает пагинацию продуктов, входящих в выбранную подкатегорию (по slug)"""
+        filters = filters or ProductFilters()
         stmt = (
             select(Product)
             .join(Product.subcategory)
-            .where(SubCategory.slug == subcat_slug)
+            .where(SubCategory.slug == subcat_slug, *filters.conditions())
         )
         if order is not None:
-            stmt = stmt.order_by(order)
+            # order может быть одним выражением или кортежем выражений
+            stmt = stmt.order_by(*order) if isinstance(order, tuple) else stmt.order_by(order)
         else:
             stmt = stmt.order_by(Product.id)
 
-        return self.db.paginate(
+        if filters.active:
+            # Количество отфильтрованных товаров заранее неизвестно - считаем его запросом
+            return self.db.paginate(stmt, page=page, per_page=per_page)
+
+        # Общее количество товаров берем из кэша, а не через COUNT(*) на каждой странице
+        pagination = self.db.paginate(
             stmt,
             page=page,
             per_page=per_page,
+            count=False,
         )
+        pagination.total = self.get_subcategory_product_count(subcat_slug=subcat_slug)
+        return pagination
+
+    def get_subcategory_product_count(self, *, subcat_slug):
+        """Возвращает количество товаров в подкатегории (кэшируется до изменения каталога)"""
+        count = subcategory_counts.get(subcat_slug)
+        if count is None:
+            count = self.db.session.execute(
+                select(func.count(Product.id))
+                .join(Product.subcategory)
+                .where(SubCategory.slug == subcat_slug)
+            ).scalar()
+            subcategory_counts.set(subcat_slug, count)
+        return count
+
+    def get_products_version(self, *, subcat_slug, filters=None):
+        """Возвращает (время последнего изменения, количество) товаров подкатегории
+        с учетом фильтров - по ним строятся валидаторы ответа со списком товаров"""
+        filters = filters or ProductFilters()
+        last_modified, count = self.db.session.execute(
+            select(func.max(Product.updated_at), func.count(Product.id))
+            .join(Product.subcategory)
+            .where(SubCategory.slug == subcat_slug, *filters.conditions())
+        ).one()
+        return last_modified, count
+
+    def get_subcategory_facets(self, *, subcat_slug):
+        """Возвращает количество товаров подкатегории для каждого варианта фильтров.
+        Диапазоны цены и веса и наличие считаются одним агрегирующим запросом,
+        префиксы артикулов - одним запросом с группировкой. Результат кэшируется до изменения каталога"""
+        facets = facet_summaries.get(subcat_slug)
+        if facets is not None:
+            return facets
+
+        columns = [func.count(Product.id).filter(Product.stock_quantity > 0)]
+        for low, high in PRICE_BUCKETS:
+            columns.append(func.count(Product.id).filter(*range_condition(Product.price, low, high)))
+        for low, high in WEIGHT_BUCKETS:
+            columns.append(func.count(Product.id).filter(*range_condition(Product.weight, low, high)))
+
+        counts = list(self.db.session.execute(
+            select(*columns)
+            .join(Product.subcategory)
+            .where(SubCategory.slug == subcat_slug)
+        ).one())
+        in_stock = counts.pop(0)
+        price_counts, weight_counts = counts[:len(PRICE_BUCKETS)], counts[len(PRICE_BUCKETS):]
+
+        prefix = sku_prefix(Product.sku)
+        sku_counts = self.db.session.execute(
+            select(prefix, func.count(Product.id))
+            .join(Product.subcategory)
+            # Товары без артикула в вариантах фильтра не участвуют
+            .where(SubCategory.slug == subcat_slug, Product.sku.isnot(None), Product.sku != '')
+            .group_by(prefix)
+            .order_by(prefix)
+        ).all()
 
-    def get_random_products(self):
-        """Возвращает список 16 случайных товаров для главной страницы"""
-        random_products = self.db.session.execute(
+        facets = {
+            'in_stock': in_stock,
+            'price': [(low, high, count) for (low, high), count in zip(PRICE_BUCKETS, price_counts)],
+            'weight': [(low, high, count) for (low, high), count in zip(WEIGHT_BUCKETS, weight_counts)],
+            'sku': [(prefix, count) for prefix, count in sku_counts],
+        }
+        facet_summaries.set(subcat_slug, facets)
+        return facets
+
+    def get_products_by_subcategory_cursor(self, *,
+                                           subcat_slug,
+                                           sort_by='id',
+                                           direction='asc',
+                                           cursor=None,
+                                           per_page=8,
+                                           filters=None,
+                                           ):
+        """Возвращает страницу продуктов подкатегории по курсору (keyset-пагинация).
+        Вместо OFFSET и COUNT(*) выбирается per_page + 1 товаров после курсора"""
+        # per_page приходит от клиента - ограничиваем так же, как db.paginate
+        per_page = min(max(per_page, 1), MAX_PER_PAGE)
+        sort_column = PRODUCT_SORT_COLUMNS.get(sort_by, Product.id)
+        sort_key = tuple_(sort_column, Product.id)
+        filters = filters or ProductFilters()
+
+        stmt = (
             select(Product)
-            .order_by(func.random())
-            .limit(8)
+            .join(Product.subcategory)
+            .where(SubCategory.slug == subcat_slug, *filters.conditions())
+        )
+
+        position = decode_cursor(cursor, sort_by=sort_by, direction=direction)
+        if direction == 'desc':
+            if position:
+                stmt = stmt.where(sort_key < tuple_(*position))
+            stmt = stmt.order_by(sort_column.desc(), Product.id.desc())
+        else:
+            if position:
+                stmt = stmt.where(sort_key > tuple_(*position))
+            stmt = stmt.order_by(sort_column.asc(), Product.id.asc())
+
+        products = self.db.session.execute(stmt.limit(per_page + 1)).scalars().all()
+
+        has_next = len(products) > per_page
+        products = products[:per_page]
+        next_cursor = encode_cursor(sort_by=sort_by, direction=direction, product=products[-1]) \
+            if has_next else None
+        return CursorPage(items=products, has_next=has_next, next_cursor=next_cursor)
+
+    def refresh_featured_products(self):
+        """Обновляет набор id товаров в наличии, из которого выбираются товары для главной страницы"""
+        product_ids = self.db.session.execute(
+            select(Product.id).where(Product.stock_quantity > 0)
         ).scalars().all()
-        return random_products
+        featured_product_ids.refresh(product_ids)
+        return len(product_ids)
+
+    def get_random_products(self, *, count=8):
+        """Возвращает список случайных товаров в наличии для главной страницы.
+        id выбираются из заранее загруженного набора, товары загружаются по первичному ключу"""
+        if not featured_product_ids.loaded:
+            self.refresh_featured_products()
+
+        product_ids = featured_product_ids.sample(count)
+        if not product_ids:
+            return []
+
+        products = {product.id: product for product in self.db.session.execute(
+            select(Product).where(Product.id.in_(product_ids))
+        ).scalars()}
+        # БД возвращает строки в своем порядке - восстанавливаем случайный порядок выборки
+        return [products[product_id] for product_id in product_ids if product_id in products]
 
     def create_product(self, *, form, cat_id, subcat_id):
         """Функция создает новый товар"""
@@ -356,6 +551,8 @@ class ProductService:
         )
         self.db.session.add(product)
         self.db.session.commit()
+        self.catalog_changed()
+        product_search_index.add_product(product)
         return product
 
     def edit_product(self, *, form, product):
@@ -368,6 +565,8 @@ class ProductService:
                 price=product.price
             )
             self.db.session.add(old_price)
+            # Храним последнюю предыдущую цену прямо в товаре
+            product.latest_price = product.price
 
         product.name = form.name.data
         product.slug = slugify(form.name.data),
@@ -378,6 +577,8 @@ class ProductService:
         product.weight = form.weight.data
 
         self.db.session.commit()
+        self.catalog_changed()
+        product_search_index.add_product(product)
         flash(message="Товар обновлен", category="success")
 
     def delete_product(self, *, product_slug):
@@ -386,18 +587,14 @@ class ProductService:
             select(Product).where(Product.slug == product_slug)
         ).scalar_one()
 
+        product_id = product.id
         self.db.session.delete(product)
         self.db.session.commit()
+        self.catalog_changed()
+        product_search_index.remove_product(product_id)
 
         flash(message="Товар удален!", category="success")
 
-    def get_product_balance(self, *, product_id):
-        """Функция возвращает количество оставшегося товара"""
-        product = self.db.session.execute(
-            select(Product).where(Product.id == product_id)).scalars().one_or_none()
-        stock_quantity = product.stock_quantity
-        return stock_quantity
-
     def delete_files_path(self, *, product_id):
         """Удаляем пути к фото товара (необходимо при изменении товара)"""
         files_path = self.db.session.execute(
@@ -408,20 +605,102 @@ class ProductService:
             self.db.session.delete(file_path)
         self.db.session.commit()
 
-    def get_main_image(self, *, product_id):
-        """Возвращает путь к главному фото товара"""
-        files_path = self.db.session.execute(
+    def get_products_with_main_images(self, *, product_ids):
+        """Возвращает ({id товара: товар}, {id товара: главное фото}) для списка id одним
+        запросом: главное фото присоединяется к товару (LEFT JOIN), у фото загружаются
+        только путь и размеры уменьшенных копий"""
+        if not product_ids:
+            return {}, {}
+
+        rows = self.db.session.execute(
+            select(Product, ProductImage)
+            .outerjoin(ProductImage, and_(ProductImage.product_id == Product.id,
+                                          ProductImage.is_main == True))
+            .options(load_only(ProductImage.product_id, ProductImage.image_path, ProductImage.variants))
+            .where(Product.id.in_(set(product_ids)))
+            .order_by(ProductImage.sort_order)
+        ).all()
+
+        products, main_images = {}, {}
+        for product, image in rows:
+            products[product.id] = product
+            if image is not None:
+                main_images.setdefault(product.id, image)
+        return products, main_images
+
+    def get_main_images(self, *, product_ids):
+        """Возвращает словарь {id товара: главное фото} для списка товаров одним запросом.
+        У фото загружаются только путь и размеры уменьшенных копий"""
+        if not product_ids:
+            return {}
+
+        images = self.db.session.execute(
             select(ProductImage)
-            .where(ProductImage.product_id == product_id, ProductImage.is_main == True)
-        ).scalars().first()
-        return files_path
+            .options(load_only(ProductImage.product_id, ProductImage.image_path, ProductImage.variants))
+            .where(ProductImage.product_id.in_(set(product_ids)), ProductImage.is_main == True)
+            .order_by(ProductImage.sort_order)
+        ).scalars().all()
 
-    def product_search(self, *, string):
-        products = self.db.session.execute(
+        main_images = {}
+        for image in images:
+            main_images.setdefault(image.product_id, image)
+        return main_images
+
+    def build_search_index(self):
+        """Строит поисковый индекс товаров в памяти процесса.
+        Пока индекс не построен, поиск выполняется средствами PostgreSQL"""
+        try:
+            products = self.db.session.execute(
+                select(Product).options(load_only(Product.id, Product.name, Product.sku, Product.description))
+            ).scalars().all()
+            product_search_index.build(products)
+            logger.info(f"Поисковый индекс построен: {len(products)} товаров")
+        except Exception as e:
+            self.db.session.rollback()
+            logger.error("Ошибка построения поискового индекса " + str(e))
+
+    def get_search_suggestions(self, *, prefix, limit=SUGGEST_LIMIT):
+        """Возвращает подсказки (подкатегории и товары), начинающиеся с prefix.
+        Индекс строится при первом запросе и после изменений каталога"""
+        if not suggest_index.ready:
+            # Номер сброса читаем до запросов: сброс во время построения не будет потерян
+            generation = suggest_index.generation
+            subcategories = self.db.session.execute(
+                select(SubCategory.name, SubCategory.slug).order_by(SubCategory.id)
+            ).all()
+            products = self.db.session.execute(
+                select(Product.name, Product.slug).order_by(Product.id)
+            ).all()
+            suggest_index.build(subcategories=subcategories, products=products, generation=generation)
+        return suggest_index.suggest(prefix, limit)
+
+    def product_search(self, *, string, page=1, per_page=20):
+        """Полнотекстовый поиск товаров (название, артикул, описание).
+        Возвращает пагинацию, отсортированную по релевантности"""
+        if current_app.config.get('SEARCH_BACKEND') == 'memory' and product_search_index.ready:
+            # Кандидаты ищутся в индексе в памяти, из БД загружается только текущая страница
+            product_ids = product_search_index.search(string)
+            page = max(page, 1)
+            page_ids = product_ids[(page - 1) * per_page:page * per_page]
+            products = self.db.session.execute(
+                select(Product).where(Product.id.in_(page_ids))
+            ).scalars().all() if page_ids else []
+            positions = {product_id: i for i, product_id in enumerate(page_ids)}
+            products.sort(key=lambda product: positions[product.id])
+            return ListPagination(items=products, page=page, per_page=per_page, total=len(product_ids))
+
+        query = func.websearch_to_tsquery('russian', string)
+        stmt = (
             select(Product)
-            .filter(Product.name.ilike(f"%{string}%"))
-        ).scalars().all()
-        return products
+            .where(Product.search_vector.op('@@')(query))
+            .order_by(func.ts_rank(Product.search_vector, query).desc(), Product.id)
+        )
+        return self.db.paginate(
+            stmt,
+            page=page,
+            per_page=per_page,
+            error_out=False,
+        )
 
 
 class CartService:
@@ -429,48 +708,61 @@ class CartService:
         self.db = db
 
     """Корзина"""
-    def add_product(self, *, user_id, product_id, quantity=1):
-        """Функция добавляет товар в корзину (1 шт.)"""
-        cart_item = CartItem(
-            user_id=user_id,
-            product_id=product_id,
-            quantity=quantity,
-        )
-        self.db.session.add(cart_item)
+    @staticmethod
+    def cart_changed():
+        """Сбрасывает количество товаров в корзине, сохраненное на время запроса"""
+        g.pop('cart_len', None)
+
+    def add_product(self, *, user_id, product_id, quantity=1, check_stock=True):
+        """Функция добавляет товар в корзину или увеличивает его количество.
+        Выполняется одним запросом INSERT ... ON CONFLICT DO UPDATE, поэтому одновременные
+        нажатия не теряют изменения. При check_stock количество в корзине не превышает остаток
+        на складе. Возвращает количество товара в корзине или None, если товара не хватает"""
+        source = select(literal(int(user_id)), Product.id, literal(quantity)).where(Product.id == product_id)
+        if check_stock:
+            source = source.where(Product.stock_quantity >= quantity)
+        stmt = pg_insert(CartItem).from_select(['user_id', 'product_id', 'quantity'], source)
+
+        new_quantity = CartItem.quantity + stmt.excluded.quantity
+        stock_quantity = select(Product.stock_quantity).where(Product.id == product_id).scalar_subquery()
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CartItem.user_id, CartItem.product_id],
+            set_={'quantity': new_quantity},
+            where=new_quantity <= stock_quantity if check_stock else None,
+        ).returning(CartItem.quantity)
+
+        cart_quantity = self.db.session.execute(stmt).scalar()
         self.db.session.commit()
-        flash("Товар добавлен в корзину", category="success")
-
-    def check_product(self, *, user_id, product_id):
-        """Функция проверяет есть ли уже товар в корзине пользователя"""
-        cart_item = self.db.session.execute(
-            select(CartItem).where(
-                CartItem.user_id==user_id,
-                CartItem.product_id==product_id)).scalar()
-        if cart_item:
-            return cart_item.quantity
-        return False
+        if cart_quantity is None:
+            return None
 
-    def increase_product(self, *, user_id, product_id, quantity=1):
-        """Функция увеличивает количество товара в корзине на 1"""
-        cart_item = self.db.session.execute(
-            select(CartItem).where(
-                CartItem.user_id == user_id,
-                CartItem.product_id == product_id)).scalar()
-        cart_item.quantity += quantity
-        self.db.session.commit()
-        flash("Количество товара увеличено", category="success")
+        self.cart_changed()
+        if cart_quantity == quantity:
+            flash("Товар добавлен в корзину", category="success")
+        else:
+            flash("Количество товара увеличено", category="success")
+        return cart_quantity
 
     def remove_product(self, *, user_id, product_id):
-        """Функция удаляет товар из корзины (1 шт.)"""
-        cart_item = self.db.session.execute(
-            select(CartItem)
-            .where(CartItem.user_id == user_id, CartItem.product_id == product_id)
-        ).scalar()
-        cart_item.quantity -= 1
-        if cart_item.quantity == 0:
-            self.db.session.delete(cart_item)
+        """Функция удаляет товар из корзины (1 шт.) одним запросом: последняя штука
+        удаляет позицию (DELETE в CTE), иначе количество уменьшается на 1"""
+        condition = and_(CartItem.user_id == user_id, CartItem.product_id == product_id)
+        deleted = (
+            delete(CartItem)
+            .where(condition, CartItem.quantity <= 1)
+            .returning(CartItem.id)
+            .cte('deleted')
+        )
+        stmt = (
+            update(CartItem)
+            .where(condition, CartItem.quantity > 1)
+            .values(quantity=CartItem.quantity - 1)
+            .add_cte(deleted)
+        )
+        self.db.session.execute(stmt)
         flash("Товар удален", category="success")
         self.db.session.commit()
+        self.cart_changed()
 
     def get_cart_items(self, *, user_id):
         """Возвращает все товары в корзине пользователя"""
@@ -479,6 +771,12 @@ class CartService:
         ).scalars().all()
         return cart_items
 
+    def count_cart_items(self, *, user_id):
+        """Возвращает количество позиций в корзине пользователя (без загрузки самих позиций)"""
+        return self.db.session.execute(
+            select(func.count()).select_from(CartItem).where(CartItem.user_id == user_id)
+        ).scalar()
+
 
     """Избранное"""
     def get_favorites(self, *, user_id):
@@ -574,6 +872,10 @@ class CartService:
                 product.stock_quantity -= item.quantity
 
             self.db.session.commit()
+            self.cart_changed()
+            # Изменились остатки - сбрасываем фасет "В наличии" и сохраненные страницы
+            facet_summaries.clear()
+            page_cache.clear()
             flash("Заказ зарезервирован на 24 часа", category="success")
         except Exception as e:
             self.db.session.rollback()
@@ -591,6 +893,7 @@ class CartService:
         """Возвращает список заказов пользователя"""
         orders = self.db.session.execute(
             select(Order)
+            .options(selectinload(Order.order_item))
             .where(Order.user_id == user_id)
             .order_by(Order.updated_at.desc())
         ).scalars().all()
@@ -630,6 +933,8 @@ class CartService:
                 product.stock_quantity += item.quantity
 
             self.db.session.commit()
+            facet_summaries.clear()
+            page_cache.clear()
             logger.info(f"Заказ {order_id} отменен")
 
         except Exception as e:
@@ -701,6 +1006,7 @@ class AdminService:
             flash("Статус пользователя успешно изменен!", category="success")
             logger.warning(f"Статус пользователя {user_id} изменен")
             self.db.session.commit()
+            UserService.forget_user(user_id=user_id)
 
     def get_users_with_orders_count(self):
         """Функция возвращает всех пользователей и количество заказов"""
@@ -0,0 +1,72 @@
+"""Фильтры списка товаров подкатегории и описание фасетов"""
+from dataclasses import dataclass, asdict
+
+from sqlalchemy import func
+
+from models import Product
+
+
+# Диапазоны цен (руб.) и веса (кг) для фасетов: (от, до), граница "до" не включается
+PRICE_BUCKETS = [(None, 10000), (10000, 30000), (30000, 60000), (60000, 100000), (100000, None)]
+WEIGHT_BUCKETS = [(None, 1), (1, 5), (5, 20), (20, None)]
+# Количество первых символов артикула, по которым группируются товары
+SKU_PREFIX_LENGTH = 3
+
+
+def range_condition(column, low, high):
+    """Условие low <= column < high (любая из границ может отсутствовать)"""
+    conditions = []
+    if low is not None:
+        conditions.append(column >= low)
+    if high is not None:
+        conditions.append(column < high)
+    return conditions
+
+
+def sku_prefix(column):
+    return func.upper(func.substr(column, 1, SKU_PREFIX_LENGTH))
+
+
+@dataclass
+class ProductFilters:
+    price_min: float | None = None
+    price_max: float | None = None
+    weight_min: float | None = None
+    weight_max: float | None = None
+    in_stock: bool = False
+    sku: str | None = None
+
+    @classmethod
+    def from_args(cls, args):
+        """Создает фильтры из параметров запроса (некорректные значения игнорируются)"""
+        sku = args.get('sku', '').strip()[:20]
+        return cls(
+            price_min=args.get('price_min', type=float),
+            price_max=args.get('price_max', type=float),
+            weight_min=args.get('weight_min', type=float),
+            weight_max=args.get('weight_max', type=float),
+            in_stock=args.get('in_stock') == '1',
+            sku=sku or None,
+        )
+
+    @property
+    def active(self):
+        return bool(self.to_args())
+
+    def conditions(self):
+        """Список условий WHERE для выбранных фильтров"""
+        conditions = range_condition(Product.price, self.price_min, self.price_max) + \
+            range_condition(Product.weight, self.weight_min, self.weight_max)
+        if self.in_stock:
+            conditions.append(Product.stock_quantity > 0)
+        if self.sku:
+            conditions.append(func.upper(Product.sku).startswith(self.sku.upper(), autoescape=True))
+        return conditions
+
+    def to_args(self):
+        """Параметры для url_for (только выбранные фильтры)"""
+        args = {key: value for key, value in asdict(self).items()
+                if value is not None and value is not False}
+        if self.in_stock:
+            args['in_stock'] = 1
+        return args
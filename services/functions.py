@@ -1,16 +1,36 @@
 import os
 import logging
-from flask import flash, session, request
+from dataclasses import dataclass
+
+from flask import flash, session, request, g
 from flask_login import current_user
+from sqlalchemy import update, func
+from werkzeug.local import LocalProxy
 from werkzeug.utils import secure_filename
 
 from .db_functions import User, CartService, ProductService, Order
-from models import ProductImage
+from models import Product, ProductImage
+from .images import create_derivatives
 
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass(frozen=True, slots=True)
+class SessionCartItem:
+    """Позиция корзины гостя (из сессии) с теми же атрибутами, что и CartItem"""
+    product_id: int
+    quantity: int
+    products: Product
+
+
+@dataclass(frozen=True, slots=True)
+class SessionFavorite:
+    """Товар в избранном гостя (из сессии) с теми же атрибутами, что и Favorite"""
+    product_id: int
+    products: Product
+
+
 def create_path_for_file(current_app, *, subfolders, file_name, product_id=None, db=None):
     # Получаем объект catalog blueprint
     catalog_bp = current_app.blueprints.get('catalog')
@@ -40,15 +60,21 @@ def create_path_for_file(current_app, *, subfolders, file_name, product_id=None,
                 file.save(abs_filepath)
                 files_path.append(abs_filepath)
 
-                # Сохраняем путь до файла в БД
+                # Сохраняем путь до файла и размеры уменьшенных копий в БД
                 img = ProductImage(
                     product_id=product_id,
                     image_path=rel_filepath,
                     sort_order=i,
-                    is_main=(i == 0)
+                    is_main=(i == 0),
+                    variants=create_derivatives(abs_filepath),
                 )
                 db.session.add(img)
+            # Фото входят в карточку товара - обновляем время его изменения (используется в ETag)
+            db.session.execute(
+                update(Product).where(Product.id == product_id).values(updated_at=func.now())
+            )
             db.session.commit()
+            ProductService(db).catalog_changed()
             flash('Фото успешно загружено!', category="success")
             return files_path
         except Exception as e:
@@ -60,21 +86,48 @@ def create_path_for_file(current_app, *, subfolders, file_name, product_id=None,
 
 
 def add_product_to_cart(db, *, user_id, product_id):
+    """Добавляет товар в корзину пользователя, если он есть в наличии (проверка остатка
+    и изменение корзины выполняются одним запросом)"""
     cart_service = CartService(db)
-    product_service = ProductService(db)
-    # Проверяем есть ли товар в наличии
-    item_left = product_service.get_product_balance(product_id=product_id)
-    # Проверяем есть ли уже этот товар в корзине
-    cart_item = cart_service.check_product(user_id=user_id, product_id=product_id)
-    if item_left > cart_item:
-        if cart_item:
-            cart_service.increase_product(user_id=user_id, product_id=product_id)
-        else:
-            cart_service.add_product(user_id=user_id, product_id=product_id)
-    else:
+    if cart_service.add_product(user_id=user_id, product_id=product_id) is None:
         flash("Извините, товар закончился", category="warning")
 
 
+def session_product_id(item):
+    """id товара из записи сессии. Избранное гостя хранит id строкой (как его прислал
+    favorites.js), поэтому значение приводится к int. None - если id некорректный"""
+    try:
+        return int(item['product_id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def get_guest_cart_items(db, *, cart_data):
+    """Позиции корзины гостя и {id товара: главное фото}: товары вместе с главными фото
+    загружаются одним запросом, удаленные из каталога товары пропускаются"""
+    items = [(session_product_id(item), item) for item in cart_data]
+    products, main_images = ProductService(db).get_products_with_main_images(
+        product_ids=[product_id for product_id, _ in items if product_id is not None])
+    cart_items = [
+        SessionCartItem(product_id=product_id, quantity=item['quantity'], products=products[product_id])
+        for product_id, item in items if product_id in products
+    ]
+    return cart_items, main_images
+
+
+def get_guest_favorites(db, *, favorite_data):
+    """Избранное гостя и {id товара: главное фото}: товары вместе с главными фото
+    загружаются одним запросом"""
+    product_ids = [session_product_id(item) for item in favorite_data]
+    products, main_images = ProductService(db).get_products_with_main_images(
+        product_ids=[product_id for product_id in product_ids if product_id is not None])
+    favorites = [
+        SessionFavorite(product_id=product_id, products=products[product_id])
+        for product_id in product_ids if product_id in products
+    ]
+    return favorites, main_images
+
+
 def transfer_guest_cart_to_user(db, *, user_id, session):
     """Перенос корзины гостя в БД пользователя"""
     if 'cart' not in session:
@@ -82,17 +135,12 @@ def transfer_guest_cart_to_user(db, *, user_id, session):
 
     cart_service = CartService(db)
     for item in session['cart']:
-        if cart_service.check_product(user_id=user_id, product_id=item['product_id']):
-            cart_service.increase_product(
-                user_id=user_id,
-                product_id=item['product_id'],
-                quantity=item['quantity'])
-        else:
-            cart_service.add_product(
-                user_id=user_id,
-                product_id=item['product_id'],
-                quantity=item['quantity'],
-            )
+        cart_service.add_product(
+            user_id=user_id,
+            product_id=item['product_id'],
+            quantity=item['quantity'],
+            check_stock=False,
+        )
 
     del session['cart'] # Очищаем сессию
     session.modified = True
@@ -116,18 +164,25 @@ def transfer_guest_favorite_to_user(db, *, user_id, session):
     logger.info("Избранное сохранено после входа")
 
 
+def get_cart_len(db):
+    """Возвращает количество товаров в корзине текущего посетителя.
+    Для пользователя - один COUNT-запрос, результат сохраняется до конца запроса
+    (сбрасывается при изменении корзины в CartService.cart_changed)"""
+    if current_user.is_authenticated:
+        if 'cart_len' not in g:
+            g.cart_len = CartService(db).count_cart_items(user_id=current_user.get_id())
+        return g.cart_len
+    # Извлекаем корзину из сессии (список словарей)
+    cart_data = session.get('cart', [])
+    return len(cart_data)
+
+
 def create_inject_cart_len(db):
     """Функция используется для контекстного процессора"""
     def inject_cart_len():
-        """Возвращает количество товаров в корзине"""
-        if current_user.is_authenticated:
-            cart_service = CartService(db)
-            cart_len = len(cart_service.get_cart_items(user_id=current_user.get_id()))
-        else:
-            # Извлекаем корзину из сессии (список словарей)
-            cart_data = session.get('cart', [])
-            cart_len = len(cart_data)
-        return dict(cart_len=cart_len)
+        """Возвращает количество товаров в корзине.
+        Значение вычисляется только если шаблон обращается к cart_len"""
+        return dict(cart_len=LocalProxy(lambda: get_cart_len(db)))
     return inject_cart_len
 
 
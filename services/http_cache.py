@@ -0,0 +1,93 @@
+"""Условные GET-запросы: валидаторы ETag/Last-Modified и ответы 304 Not Modified"""
+import os
+import hashlib
+import time
+from datetime import timezone
+
+from flask import request, session, current_app
+from flask_login import current_user
+
+
+def make_etag(*parts):
+    """Возвращает хэш от данных, определяющих содержимое ответа"""
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def init_build_version(app):
+    """Версия сборки: хэш имен, размеров и времени изменения шаблонов и статических файлов
+    приложения и blueprint-ов (одинакова во всех процессах). Входит в ETag страниц, чтобы
+    после обновления шаблонов или статики браузер не получил 304 на устаревший HTML.
+    Можно задать явно переменной окружения BUILD_VERSION (например, хэш коммита)"""
+    if app.config.get('BUILD_VERSION'):
+        return
+    folders = []
+    for scaffold in (app, *app.blueprints.values()):
+        if scaffold.template_folder:
+            folders.append(os.path.join(scaffold.root_path, scaffold.template_folder))
+        if scaffold.static_folder:
+            folders.append(scaffold.static_folder)
+
+    digest = hashlib.sha1()
+    for folder in sorted(set(folders)):
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                # Сжатые копии (.gz/.br) создаются отдельно и на содержимое не влияют
+                if name.endswith(('.gz', '.br')):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+    app.config['BUILD_VERSION'] = digest.hexdigest()[:16]
+
+
+def build_version():
+    return current_app.config.get('BUILD_VERSION')
+
+
+def viewer_state(*, cart_len, favorite_ids=()):
+    """Данные посетителя, выводимые на HTML-странице: корзина в шапке, отметки избранного,
+    flash-сообщения и CSRF-токен. Токен действует WTF_CSRF_TIME_LIMIT секунд, поэтому в состояние
+    входит номер временного окна - сохраненная в браузере страница не получит просроченный токен"""
+    time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    csrf_window = int(time.time() // (time_limit / 2)) if time_limit else 0
+    return (
+        current_user.get_id(),
+        session.get('csrf_token'),
+        csrf_window,
+        '_flashes' in session,
+        cart_len,
+        tuple(sorted(favorite_ids)),
+    )
+
+
+def _as_utc(moment):
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment
+
+
+def is_not_modified(*, etag, last_modified=None):
+    """Проверяет If-None-Match и If-Modified-Since запроса (If-None-Match имеет приоритет)"""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since:
+        # Last-Modified передается с точностью до секунды
+        return _as_utc(last_modified).replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def set_validators(response, *, etag, last_modified=None, private=False):
+    """Добавляет в ответ валидаторы. Браузер сохраняет ответ, но перед использованием
+    проверяет его актуальность (Cache-Control: no-cache)"""
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = _as_utc(last_modified)
+    response.cache_control.no_cache = True
+    if private:
+        response.cache_control.private = True
+    return response
+
+
+def not_modified_response(*, etag, last_modified=None, private=False):
+    """Ответ 304 без тела"""
+    response = current_app.response_class(status=304)
+    return set_validators(response, etag=etag, last_modified=last_modified, private=private)
@@ -0,0 +1,138 @@
+"""Команда flask regenerate-images: создает уменьшенные копии (WebP и JPEG) для всех
+фото товаров, категорий и подкатегорий, уже лежащих на диске.
+Файлы обрабатываются параллельно в нескольких процессах. Копии, которые не старше
+оригинала, не пересоздаются, а размеры сохраняются в БД пачками - поэтому прерванную
+команду можно просто запустить еще раз, она продолжит с необработанных файлов"""
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select, update, func
+
+from extensions import db
+from models import Product, ProductImage, Category, SubCategory
+from .cache import catalog_stamp
+from .images import Image, create_derivatives, derivatives_are_fresh, derivative_sizes
+
+
+logger = logging.getLogger(__name__)
+
+# Через сколько обработанных файлов сохранять результаты в БД
+REGENERATE_COMMIT_EVERY = 200
+
+# Результаты обработки одного файла
+STATUS_CREATED = 'created'
+STATUS_SKIPPED = 'skipped'
+STATUS_MISSING = 'missing'
+STATUS_FAILED = 'failed'
+
+
+def regenerate_file(path, force=False):
+    """Выполняется в дочернем процессе: создает копии одного файла.
+    Возвращает (статус, {размер: [ширина, высота]} или None)"""
+    if not os.path.isfile(path):
+        return STATUS_MISSING, None
+    if not force and derivatives_are_fresh(path):
+        variants = derivative_sizes(path)
+        if variants:
+            return STATUS_SKIPPED, variants
+    variants = create_derivatives(path)
+    return (STATUS_CREATED, variants) if variants else (STATUS_FAILED, None)
+
+
+def collect_images(images_folder):
+    """Все фото каталога: список (модель, id, текущие размеры копий, абсолютный путь, id товара)"""
+    jobs = []
+    rows = db.session.execute(
+        select(ProductImage.id, ProductImage.product_id, ProductImage.image_path, ProductImage.variants)
+        .order_by(ProductImage.id)
+    )
+    for image_id, product_id, image_path, variants in rows:
+        jobs.append((ProductImage, image_id, variants,
+                     os.path.join(images_folder, *image_path.split('/')), product_id))
+
+    rows = db.session.execute(
+        select(Category.id, Category.picture, Category.picture_variants).order_by(Category.id)
+    )
+    for category_id, picture, variants in rows:
+        jobs.append((Category, category_id, variants,
+                     os.path.join(images_folder, 'categories', picture), None))
+
+    rows = db.session.execute(
+        select(SubCategory.id, SubCategory.picture, SubCategory.picture_variants, Category.slug)
+        .join(Category, SubCategory.category_id == Category.id)
+        .order_by(SubCategory.id)
+    )
+    for subcategory_id, picture, variants, category_slug in rows:
+        jobs.append((SubCategory, subcategory_id, variants,
+                     os.path.join(images_folder, 'subcategories', category_slug, picture), None))
+    return jobs
+
+
+def save_variants(changes):
+    """Сохраняет новые размеры копий. changes: список (модель, id, размеры, id товара)"""
+    if not changes:
+        return
+    for model, column in ((ProductImage, 'variants'), (Category, 'picture_variants'),
+                          (SubCategory, 'picture_variants')):
+        rows = [{'id': row_id, column: variants} for row_model, row_id, variants, _ in changes
+                if row_model is model]
+        if rows:
+            db.session.execute(update(model), rows)
+
+    # Фото входят в карточку товара - обновляем время его изменения (используется в ETag)
+    product_ids = {product_id for _, _, _, product_id in changes if product_id is not None}
+    if product_ids:
+        db.session.execute(
+            update(Product).where(Product.id.in_(product_ids)).values(updated_at=func.now())
+        )
+    db.session.commit()
+
+
+@click.command('regenerate-images')
+@click.option('--workers', type=int, default=None,
+              help="Количество процессов (по умолчанию - по числу ядер)")
+@click.option('--force', is_flag=True, help="Пересоздать копии, даже если они не старше оригинала")
+@with_appcontext
+def regenerate_images_command(workers, force):
+    """Создает уменьшенные копии для всех фото товаров, категорий и подкатегорий"""
+    if Image is None:
+        raise click.ClickException("Пакет Pillow не установлен - копии изображений создать нельзя")
+
+    images_folder = os.path.join(current_app.blueprints['catalog'].static_folder, 'images')
+    jobs = collect_images(images_folder)
+    counters = dict.fromkeys((STATUS_CREATED, STATUS_SKIPPED, STATUS_MISSING, STATUS_FAILED), 0)
+    changes = []
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(regenerate_file, path, force): (model, row_id, variants, product_id)
+            for model, row_id, variants, path, product_id in jobs
+        }
+        with click.progressbar(length=len(futures), label="Обработка изображений") as bar:
+            for future in as_completed(futures):
+                model, row_id, old_variants, product_id = futures[future]
+                try:
+                    status, variants = future.result()
+                except Exception as e:
+                    logger.error(f"Ошибка обработки изображения {model.__name__} id={row_id}: {e}")
+                    status, variants = STATUS_FAILED, None
+                counters[status] += 1
+                if variants and variants != old_variants:
+                    changes.append((model, row_id, variants, product_id))
+                if len(changes) >= REGENERATE_COMMIT_EVERY:
+                    save_variants(changes)
+                    changes = []
+                bar.update(1)
+
+    save_variants(changes)
+    # Кэши каталога живут в процессах сервера - сообщаем им об изменении через файл-отметку
+    catalog_stamp.touch()
+
+    click.echo(
+        f"Создано: {counters[STATUS_CREATED]}, без изменений: {counters[STATUS_SKIPPED]}, "
+        f"нет файла: {counters[STATUS_MISSING]}, ошибок: {counters[STATUS_FAILED]}"
+    )
@@ -0,0 +1,133 @@
+"""Изображения каталога произвольного размера, создаваемые по первому запросу.
+Результаты хранятся в дисковом кэше с ограничением общего размера (вытесняются
+давно запрошенные файлы), параллельные запросы одного файла ждут единственного уменьшения"""
+import os
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.security import safe_join
+
+from .images import Image, resize_image
+
+
+logger = logging.getLogger(__name__)
+
+# Форматы изображений, которые можно уменьшать
+RESIZABLE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.gif')
+# Максимальная сторона запрашиваемого изображения
+RESIZE_MAX_SIDE = 2000
+
+
+class ImageResizeCache:
+    """Дисковый LRU-кэш: ключ (<ширина>x<высота>/<путь>) -> файл уменьшенного изображения"""
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total = 0
+        self._lock = threading.Lock()
+        # Ключи, для которых сейчас выполняется уменьшение: ключ -> событие завершения
+        self._inflight = {}
+        self._load()
+
+    def _load(self):
+        """Восстанавливает состояние кэша с диска (порядок - по времени изменения файлов)"""
+        files = []
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, os.path.relpath(path, self.folder), stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total += size
+
+    def get(self, key, source, render):
+        """Возвращает путь к файлу в кэше. Если файла нет или он старше source -
+        создает его вызовом render(source, target). Одновременные запросы одного ключа
+        ждут, пока первый из них создаст файл"""
+        path = os.path.join(self.folder, key)
+        while True:
+            with self._lock:
+                cached = key in self._entries
+                if cached:
+                    self._entries.move_to_end(key)
+            if cached and self._is_fresh(path, source):
+                return path
+
+            with self._lock:
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+            if not owner:
+                event.wait()
+                continue
+
+            try:
+                self._store(key, path, source, render)
+            finally:
+                with self._lock:
+                    del self._inflight[key]
+                event.set()
+            return path
+
+    @staticmethod
+    def _is_fresh(path, source):
+        try:
+            return os.path.getmtime(path) >= os.path.getmtime(source)
+        except OSError:
+            return False
+
+    def _store(self, key, path, source, render):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Пишем во временный файл, чтобы параллельные чтения не увидели недописанный файл
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            render(source, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self._total += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            self._evict()
+
+    def _evict(self):
+        """Удаляет давно запрошенные файлы, пока кэш больше max_bytes (вызывается под блокировкой)"""
+        while self._total > self.max_bytes and len(self._entries) > 1:
+            key, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.folder, key))
+            except OSError as e:
+                logger.warning(f"Не удалось удалить файл кэша изображений {key}: {e}")
+
+
+def resized_image_path(filename, width, height):
+    """Возвращает путь к изображению каталога filename (относительно папки static каталога),
+    уменьшенному до width x height. None - если файла нет или размер недопустим.
+    Без Pillow возвращает путь к оригиналу"""
+    if width < 0 or height < 0 or not (width or height) or max(width, height) > RESIZE_MAX_SIDE:
+        return None
+    if not filename.lower().endswith(RESIZABLE_EXTENSIONS):
+        return None
+
+    static_folder = current_app.blueprints['catalog'].static_folder
+    source = safe_join(static_folder, filename)
+    if source is None or not os.path.isfile(source):
+        return None
+    if Image is None:
+        return source
+
+    cache = current_app.extensions['image_resize_cache']
+    return cache.get(
+        f"{width}x{height}/{filename}",
+        source,
+        lambda src, target: resize_image(src, target, width, height),
+    )
@@ -0,0 +1,184 @@
+"""Уменьшенные копии изображений каталога (WebP и JPEG) и их вывод в шаблонах.
+Копии создаются при загрузке фото пакетом Pillow (входит в requirements.txt).
+Если Pillow все же не установлен, сохраняется только оригинал и шаблоны выводят его"""
+import io
+import os
+import logging
+import posixpath
+
+from flask import url_for
+from markupsafe import Markup, escape
+
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    logger.warning("Пакет Pillow не установлен - уменьшенные копии изображений не создаются")
+
+# Размеры копий: наибольшая сторона в пикселях (меньшие изображения не увеличиваются)
+IMAGE_SIZES = {'thumb': 160, 'card': 400, 'full': 1200}
+# Форматы копий: расширение -> (формат Pillow, параметры сохранения)
+IMAGE_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+# Копии хранятся во вложенной папке рядом с оригиналом
+DERIVATIVES_FOLDER = 'sizes'
+PLACEHOLDER_IMAGE = 'placeholder.jpg'
+# Наибольшая сторона аватара пользователя в пикселях
+AVATAR_SIZE = 256
+
+
+def derivative_path(path, size, fmt, *, pathmodule=os.path):
+    """Путь к копии изображения: <папка>/sizes/<имя>_<размер>.<формат>"""
+    folder, name = pathmodule.split(path)
+    stem = pathmodule.splitext(name)[0]
+    return pathmodule.join(folder, DERIVATIVES_FOLDER, f"{stem}_{size}.{fmt}")
+
+
+def create_derivatives(path):
+    """Создает копии изображения всех размеров и форматов.
+    Возвращает {размер: [ширина, высота]} для сохранения в БД или None,
+    если Pillow не установлен или файл не удалось обработать"""
+    if Image is None:
+        return None
+
+    try:
+        with Image.open(path) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+            os.makedirs(os.path.join(os.path.dirname(path), DERIVATIVES_FOLDER), exist_ok=True)
+            variants = {}
+            for size, max_side in IMAGE_SIZES.items():
+                resized = image.copy()
+                resized.thumbnail((max_side, max_side), Image.LANCZOS)
+                for fmt, (pil_format, options) in IMAGE_FORMATS.items():
+                    result = resized
+                    if pil_format == 'JPEG' and result.mode == 'RGBA':
+                        # JPEG не поддерживает прозрачность - кладем изображение на белый фон
+                        result = Image.new('RGB', resized.size, 'white')
+                        result.paste(resized, mask=resized.getchannel('A'))
+                    result.save(derivative_path(path, size, fmt), pil_format, **options)
+                variants[size] = list(resized.size)
+            return variants
+    except (OSError, ValueError) as e:
+        logger.error(f"Ошибка создания копий изображения {path}: {e}")
+        return None
+
+
+def derivatives_are_fresh(path):
+    """Все копии изображения существуют и не старше оригинала"""
+    try:
+        mtime = os.path.getmtime(path)
+        return all(
+            os.path.getmtime(derivative_path(path, size, fmt)) >= mtime
+            for size in IMAGE_SIZES
+            for fmt in IMAGE_FORMATS
+        )
+    except OSError:
+        return False
+
+
+def derivative_sizes(path):
+    """Размеры уже созданных копий {размер: [ширина, высота]} (читаются только заголовки файлов)"""
+    try:
+        variants = {}
+        for size in IMAGE_SIZES:
+            with Image.open(derivative_path(path, size, 'jpeg')) as image:
+                variants[size] = list(image.size)
+        return variants
+    except (OSError, ValueError):
+        return None
+
+
+def resize_image(source, target, width, height):
+    """Вписывает изображение в рамку width x height (0 - без ограничения по стороне)
+    и сохраняет в target в формате оригинала"""
+    with Image.open(source) as original:
+        pil_format = original.format
+        image = ImageOps.exif_transpose(original)
+        image.thumbnail((width or image.width, height or image.height), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        options = {'JPEG': IMAGE_FORMATS['jpeg'][1], 'WEBP': IMAGE_FORMATS['webp'][1]}.get(pil_format, {})
+        image.save(target, pil_format, **options)
+
+
+def prepare_avatar(data):
+    """Уменьшает загруженный аватар до AVATAR_SIZE и пересжимает в PNG.
+    Возвращает байты изображения или None, если файл не является изображением.
+    Без Pillow возвращает данные без изменений"""
+    if Image is None:
+        return data
+
+    try:
+        with Image.open(io.BytesIO(data)) as original:
+            image = ImageOps.exif_transpose(original)
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA')
+            image.thumbnail((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+            result = io.BytesIO()
+            image.save(result, 'PNG', optimize=True)
+            return result.getvalue()
+    except (OSError, ValueError) as e:
+        logger.warning(f"Не удалось обработать аватар: {e}")
+        return None
+
+
+def delete_derivatives(path):
+    """Удаляет копии изображения (оригинал не затрагивается)"""
+    for size in IMAGE_SIZES:
+        for fmt in IMAGE_FORMATS:
+            try:
+                os.remove(derivative_path(path, size, fmt))
+            except FileNotFoundError:
+                pass
+
+
+def image_url(path, variants=None, size='full', fmt='jpeg'):
+    """URL копии изображения (path - относительно папки images каталога).
+    Если копий нет - URL оригинала, если нет и оригинала - заглушки"""
+    if not path:
+        path = PLACEHOLDER_IMAGE
+    elif variants and size in variants:
+        path = derivative_path(path, size, fmt, pathmodule=posixpath)
+    return url_for('catalog.static', filename=f"images/{path}")
+
+
+def image_srcset(path, variants, fmt='webp'):
+    """Значение атрибута srcset: все размеры копий с их шириной"""
+    if not path or not variants:
+        return ''
+    candidates = {}
+    for size in IMAGE_SIZES:
+        # Маленький оригинал дает копии одинаковой ширины - оставляем одну из них
+        if size in variants and variants[size][0] not in candidates:
+            candidates[variants[size][0]] = image_url(path, variants, size, fmt)
+    return ', '.join(f"{url} {width}w" for width, url in candidates.items())
+
+
+def picture(path, variants=None, *, size='card', alt='', css_class=None, element_id=None):
+    """HTML-элемент <picture>: WebP и JPEG копии, из которых браузер выбирает
+    подходящий размер. Если копий нет - обычный <img> с оригиналом"""
+    attributes = f' alt="{escape(alt)}"'
+    if css_class:
+        attributes += f' class="{escape(css_class)}"'
+    if element_id:
+        attributes += f' id="{escape(element_id)}"'
+
+    if not path or not variants:
+        return Markup(f'<img src="{escape(image_url(path))}"{attributes}>')
+
+    sizes = f"{IMAGE_SIZES[size]}px"
+    return Markup(
+        '<picture>'
+        f'<source type="image/webp" srcset="{escape(image_srcset(path, variants, "webp"))}" sizes="{sizes}">'
+        f'<img src="{escape(image_url(path, variants, size))}" '
+        f'srcset="{escape(image_srcset(path, variants, "jpeg"))}" sizes="{sizes}" loading="lazy"{attributes}>'
+        '</picture>'
+    )
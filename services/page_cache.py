@@ -0,0 +1,90 @@
+"""Кэш HTML-страниц каталога для анонимных посетителей.
+Страница сохраняется по URL с параметрами запроса, CSRF-токен в ней заменяется
+на метку и подставляется заново для каждого посетителя.
+Если представление записало в g.page_version версию содержимого, она сохраняется
+вместе со страницей и используется для ETag при ответе из кэша"""
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import request, session, g, current_app, make_response
+from flask_login import current_user
+
+from .http_cache import make_etag, viewer_state, is_not_modified, set_validators, not_modified_response
+
+
+# Метка вместо CSRF-токена в сохраненной странице
+CSRF_PLACEHOLDER = '__page_cache_csrf_token__'
+# Максимальное количество страниц в кэше (вытесняются давно запрошенные)
+PAGE_CACHE_SIZE = 500
+
+
+class PageCache:
+    """Потокобезопасный LRU-кэш: URL -> (HTML страницы, версия содержимого)"""
+    def __init__(self, max_entries=PAGE_CACHE_SIZE):
+        self._pages = OrderedDict()
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+            return page
+
+    def set(self, key, body, version=None):
+        with self._lock:
+            self._pages[key] = (body, version)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self._max_entries:
+                self._pages.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+
+page_cache = PageCache()
+
+
+def page_is_shareable():
+    """Страницу можно брать из кэша, только если она не зависит от сессии:
+    посетитель не авторизован, корзина и избранное пусты, нет flash-сообщений"""
+    if not current_app.config.get('PAGE_CACHE_ENABLED', True) or request.method != 'GET':
+        return False
+    if current_user.is_authenticated:
+        return False
+    return not (session.get('cart') or session.get('favorite') or session.get('_flashes'))
+
+
+def cache_anonymous_page(view):
+    """Декоратор представления: отдает анонимным посетителям сохраненную HTML-страницу"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not page_is_shareable():
+            return view(*args, **kwargs)
+
+        key = request.full_path
+        page = page_cache.get(key)
+        if page is not None:
+            body, version = page
+            # Страница общая, значит корзина и избранное посетителя пусты
+            etag = make_etag(version, viewer_state(cart_len=0)) if version else None
+            if etag and is_not_modified(etag=etag):
+                return not_modified_response(etag=etag, private=True)
+
+            response = current_app.response_class(
+                body.replace(CSRF_PLACEHOLDER, g.csrf_token), mimetype='text/html')
+            if etag:
+                set_validators(response, etag=etag, private=True)
+            response.headers['X-Page-Cache'] = 'HIT'
+            return response
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200 and response.mimetype == 'text/html':
+            body = response.get_data(as_text=True).replace(g.csrf_token, CSRF_PLACEHOLDER)
+            page_cache.set(key, body, version=g.get('page_version'))
+            response.headers['X-Page-Cache'] = 'MISS'
+        return response
+    return wrapper
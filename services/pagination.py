@@ -0,0 +1,91 @@
+"""Курсорная (keyset) пагинация товаров"""
+import json
+import base64
+import binascii
+from dataclasses import dataclass
+
+from models import Product
+
+
+# Поля, по которым разрешена сортировка списка товаров
+PRODUCT_SORT_COLUMNS = {
+    'id': Product.id,
+    'price': Product.price,
+    'name': Product.name,
+}
+# Допустимые типы значения поля сортировки в курсоре (bool отбрасывается отдельно)
+CURSOR_VALUE_TYPES = {
+    'id': int,
+    'price': (int, float),
+    'name': str,
+}
+# Максимальный размер страницы (как max_per_page у db.paginate)
+MAX_PER_PAGE = 100
+
+
+@dataclass
+class CursorPage:
+    """Страница товаров при курсорной пагинации"""
+    items: list
+    has_next: bool
+    next_cursor: str | None = None
+
+
+def encode_cursor(*, sort_by, direction, product):
+    """Формирует непрозрачный курсор по последнему товару страницы"""
+    value = getattr(product, sort_by)
+    raw = json.dumps([sort_by, direction, value, product.id], ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *, sort_by, direction):
+    """Возвращает (значение поля сортировки, id товара) из курсора.
+    Если курсор поврежден или относится к другой сортировке - возвращает None"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cur_sort_by, cur_direction, value, product_id = json.loads(
+            base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        return None
+
+    if cur_sort_by != sort_by or cur_direction != direction:
+        return None
+    if not _is_cursor_value(product_id, int) or \
+            not _is_cursor_value(value, CURSOR_VALUE_TYPES.get(sort_by, int)):
+        return None
+    return value, product_id
+
+
+def _is_cursor_value(value, types):
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+class ListPagination:
+    """Пагинация по заранее известному списку (интерфейс как у Pagination Flask-SQLAlchemy)"""
+    def __init__(self, *, items, page, per_page, total):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+
+    @property
+    def pages(self):
+        return -(-self.total // self.per_page) if self.total else 0
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    @property
+    def prev_num(self):
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def has_next(self):
+        return self.page < self.pages
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
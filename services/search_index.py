@@ -0,0 +1,189 @@
+"""Поисковый индекс товаров в памяти процесса (альтернатива полнотекстовому поиску PostgreSQL).
+Инвертированный индекс по названию, артикулу и описанию с упрощенным стеммингом
+русских слов и поиском с опечатками по триграммам и расстоянию Левенштейна"""
+import re
+import threading
+from collections import defaultdict
+
+
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+
+# Окончания русских слов, отсекаемые при стемминге (от длинных к коротким)
+RUSSIAN_ENDINGS = sorted({
+    # прилагательные и причастия
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+    'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+    # существительные
+    'иями', 'ями', 'ами', 'ией', 'ием', 'иям', 'иях', 'ях', 'ах', 'ам', 'ов', 'ев', 'ия', 'ья',
+    'ье', 'ям', 'ию', 'ью', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я',
+    # глаголы
+    'ешь', 'ете', 'ите', 'ует', 'уют', 'ить', 'ать', 'ять', 'еть', 'ть',
+}, key=len, reverse=True)
+
+MIN_STEM_LENGTH = 3
+
+# Вес совпадения в зависимости от поля товара
+FIELD_WEIGHTS = {'name': 3.0, 'sku': 3.0, 'description': 1.0}
+# Совпадение с опечаткой ценится меньше точного
+FUZZY_PENALTY = 0.5
+
+
+def stem(word):
+    """Упрощенный стемминг: отсекает окончание русского слова"""
+    if not ('а' <= word[0] <= 'я'):
+        return word
+    for ending in RUSSIAN_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text):
+    """Разбивает текст на нормализованные основы слов"""
+    if not text:
+        return []
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in TOKEN_RE.findall(text)]
+
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_typos(term):
+    """Допустимое число опечаток зависит от длины слова"""
+    if len(term) < 4:
+        return 0
+    if len(term) < 8:
+        return 1
+    return 2
+
+
+def edit_distance(a, b, limit):
+    """Расстояние Левенштейна с ранним выходом, если оно превышает limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i]
+        for j, char_b in enumerate(b, start=1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class ProductSearchIndex:
+    """Инвертированный индекс: основа слова -> {id товара: вес}"""
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._trigrams = defaultdict(set)
+        self._documents = {}
+        self._lock = threading.RLock()
+        self.ready = False
+
+    def build(self, products):
+        """Полностью перестраивает индекс по списку товаров"""
+        with self._lock:
+            self._postings.clear()
+            self._trigrams.clear()
+            self._documents.clear()
+            for product in products:
+                self._add(product)
+            self.ready = True
+
+    def add_product(self, product):
+        """Добавляет товар в индекс или обновляет его"""
+        if not self.ready:
+            return
+        with self._lock:
+            self._remove(product.id)
+            self._add(product)
+
+    def remove_product(self, product_id):
+        if not self.ready:
+            return
+        with self._lock:
+            self._remove(product_id)
+
+    def search(self, query):
+        """Возвращает id найденных товаров, отсортированные по релевантности.
+        Товар должен содержать каждое слово запроса (точно или с опечаткой)"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        with self._lock:
+            scores = None
+            for term in terms:
+                term_scores = self._match_term(term)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {product_id: score + term_scores[product_id]
+                              for product_id, score in scores.items() if product_id in term_scores}
+                if not scores:
+                    return []
+
+        return sorted(scores, key=lambda product_id: (-scores[product_id], product_id))
+
+    def _match_term(self, term):
+        matches = dict(self._postings.get(term, {}))
+
+        limit = max_typos(term)
+        if limit:
+            for candidate in self._fuzzy_candidates(term):
+                if candidate == term or edit_distance(term, candidate, limit) > limit:
+                    continue
+                for product_id, weight in self._postings[candidate].items():
+                    fuzzy_weight = weight * FUZZY_PENALTY
+                    if fuzzy_weight > matches.get(product_id, 0):
+                        matches[product_id] = fuzzy_weight
+        return matches
+
+    def _fuzzy_candidates(self, term):
+        """Слова словаря, имеющие достаточно общих триграмм с term"""
+        term_trigrams = trigrams(term)
+        shared = defaultdict(int)
+        for trigram in term_trigrams:
+            for candidate in self._trigrams.get(trigram, ()):
+                shared[candidate] += 1
+        # Каждая опечатка портит не более трех триграмм
+        threshold = max(1, len(term_trigrams) - 3 * max_typos(term))
+        return [candidate for candidate, count in shared.items() if count >= threshold]
+
+    def _add(self, product):
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(product, field)):
+                weights[term] += weight
+
+        for term, weight in weights.items():
+            if term not in self._postings:
+                for trigram in trigrams(term):
+                    self._trigrams[trigram].add(term)
+            self._postings[term][product.id] = weight
+        self._documents[product.id] = set(weights)
+
+    def _remove(self, product_id):
+        for term in self._documents.pop(product_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[term]
+                for trigram in trigrams(term):
+                    self._trigrams[trigram].discard(term)
+                    if not self._trigrams[trigram]:
+                        del self._trigrams[trigram]
+
+
+# Индекс строится при запуске приложения, если выбран SEARCH_BACKEND=memory
+product_search_index = ProductSearchIndex()
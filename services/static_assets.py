@@ -0,0 +1,230 @@
+"""Статические файлы: хэш содержимого в URL, долгое кэширование в браузере,
+отдача заранее сжатых копий (.br/.gz) CSS и JS и передача отдачи файлов
+фронтовому серверу (X-Accel-Redirect для nginx или X-Sendfile)"""
+import os
+import gzip
+import hashlib
+import mimetypes
+import threading
+from urllib.parse import quote
+
+import click
+from flask import current_app, request, send_from_directory
+from flask.cli import with_appcontext
+from werkzeug.http import parse_accept_header
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Имя параметра URL с хэшем содержимого файла
+STATIC_HASH_PARAM = 'v'
+STATIC_HASH_LENGTH = 12
+# Файлы с хэшем в URL не меняются - браузер кэширует их на год без проверок
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+# Расширения файлов, для которых создаются сжатые копии
+PRECOMPRESS_EXTENSIONS = ('.css', '.js', '.svg')
+# Сжатые копии в порядке предпочтения: (Content-Encoding, расширение файла)
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# Режимы передачи файлов фронтовому серверу (STATIC_OFFLOAD)
+OFFLOAD_X_ACCEL = 'x-accel'
+OFFLOAD_X_SENDFILE = 'x-sendfile'
+
+
+class StaticHashes:
+    """Хэши содержимого статических файлов (пересчитываются при изменении файла)"""
+    def __init__(self):
+        self._hashes = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+        with self._lock:
+            cached = self._hashes.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        if not os.path.isfile(path):
+            return None
+        digest = hashlib.md5()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        file_hash = digest.hexdigest()[:STATIC_HASH_LENGTH]
+
+        with self._lock:
+            self._hashes[path] = (mtime, file_hash)
+        return file_hash
+
+
+static_hashes = StaticHashes()
+
+
+def is_static_endpoint(endpoint):
+    return endpoint is not None and (endpoint == 'static' or endpoint.endswith('.static'))
+
+
+def static_folder(endpoint):
+    """Папка статических файлов приложения или blueprint-а"""
+    if endpoint == 'static':
+        return current_app.static_folder
+    blueprint = current_app.blueprints.get(endpoint.rsplit('.', 1)[0])
+    return blueprint.static_folder if blueprint else None
+
+
+def static_file_path(endpoint, filename):
+    folder = static_folder(endpoint)
+    if not folder or not filename:
+        return None
+    return safe_join(folder, filename)
+
+
+def add_static_hash(endpoint, values):
+    """url_defaults: добавляет к URL статического файла хэш его содержимого"""
+    if not is_static_endpoint(endpoint) or STATIC_HASH_PARAM in values:
+        return
+    path = static_file_path(endpoint, values.get('filename'))
+    file_hash = static_hashes.get(path) if path else None
+    if file_hash:
+        values[STATIC_HASH_PARAM] = file_hash
+
+
+def offload_file_response(path, *, mimetype=None):
+    """Ответ без тела с заголовком, по которому файл отдает фронтовой сервер.
+    Возвращает None, если режим выключен или файл нельзя передать (тогда файл отдает Flask).
+
+    x-accel: nginx получает URI внутреннего location: STATIC_OFFLOAD_PREFIX + путь файла
+    относительно STATIC_OFFLOAD_ROOT (по умолчанию - папка проекта), например:
+        location /protected/ { internal; alias /app/; }
+    x-sendfile: сервер получает абсолютный путь к файлу"""
+    mode = current_app.config.get('STATIC_OFFLOAD')
+    if not mode or not os.path.isfile(path):
+        return None
+
+    response = current_app.response_class(mimetype=mimetype or mimetypes.guess_type(path)[0])
+    if mode == OFFLOAD_X_ACCEL:
+        root = current_app.config.get('STATIC_OFFLOAD_ROOT') or current_app.root_path
+        relative_path = os.path.relpath(os.path.abspath(path), os.path.abspath(root))
+        if relative_path.startswith('..'):
+            return None
+        prefix = current_app.config.get('STATIC_OFFLOAD_PREFIX', '/protected').rstrip('/')
+        response.headers['X-Accel-Redirect'] = f"{prefix}/{quote(relative_path.replace(os.sep, '/'))}"
+    elif mode == OFFLOAD_X_SENDFILE:
+        response.headers['X-Sendfile'] = os.path.abspath(path)
+    else:
+        return None
+    return response
+
+
+def offload_static():
+    """before_request: передает отдачу статического файла фронтовому серверу (если режим включен)"""
+    if not current_app.config.get('STATIC_OFFLOAD') or not is_static_endpoint(request.endpoint):
+        return None
+    path = static_file_path(request.endpoint, (request.view_args or {}).get('filename'))
+    return offload_file_response(path) if path else None
+
+
+def serve_precompressed():
+    """before_request: отдает сжатую копию файла (.br/.gz), если клиент ее принимает
+    и копия не старше исходного файла"""
+    if not is_static_endpoint(request.endpoint) or request.method != 'GET':
+        return None
+    filename = (request.view_args or {}).get('filename', '')
+    if not filename.endswith(PRECOMPRESS_EXTENSIONS):
+        return None
+    path = static_file_path(request.endpoint, filename)
+    if not path or not os.path.isfile(path):
+        return None
+
+    accepted = parse_accept_header(request.headers.get('Accept-Encoding', ''))
+    for encoding, extension in PRECOMPRESSED_ENCODINGS:
+        compressed_path = path + extension
+        if not accepted[encoding] or not os.path.isfile(compressed_path):
+            continue
+        if os.path.getmtime(compressed_path) < os.path.getmtime(path):
+            continue
+        response = send_from_directory(
+            static_folder(request.endpoint),
+            filename + extension,
+            mimetype=mimetypes.guess_type(filename)[0],
+        )
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+    return None
+
+
+def set_static_cache_headers(response):
+    """after_request: URL с актуальным хэшем кэшируется браузером на год"""
+    if not is_static_endpoint(request.endpoint) or response.status_code not in (200, 304):
+        return response
+    requested_hash = request.args.get(STATIC_HASH_PARAM)
+    if not requested_hash:
+        return response
+    path = static_file_path(request.endpoint, (request.view_args or {}).get('filename'))
+    if path and requested_hash == static_hashes.get(path):
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+        response.cache_control.no_cache = None
+    return response
+
+
+def precompress_file(path):
+    """Создает сжатые копии файла, если их нет или они старше исходного.
+    Возвращает количество созданных файлов"""
+    created = 0
+    with open(path, 'rb') as file:
+        data = file.read()
+    mtime = os.path.getmtime(path)
+
+    compressors = [('.gz', lambda content: gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        compressors.append(('.br', lambda content: brotli.compress(content, quality=11)))
+
+    for extension, compress in compressors:
+        compressed_path = path + extension
+        if os.path.isfile(compressed_path) and os.path.getmtime(compressed_path) >= mtime:
+            continue
+        with open(compressed_path, 'wb') as file:
+            file.write(compress(data))
+        created += 1
+    return created
+
+
+def static_folders(app):
+    folders = [app.static_folder] + [blueprint.static_folder for blueprint in app.blueprints.values()]
+    return [folder for folder in folders if folder and os.path.isdir(folder)]
+
+
+@click.command('compress-static')
+@with_appcontext
+def compress_static_command():
+    """Создает .gz (и .br, если установлен brotli) копии CSS/JS/SVG во всех папках static"""
+    created = 0
+    for folder in static_folders(current_app):
+        for root, _, files in os.walk(folder):
+            for name in files:
+                if name.endswith(PRECOMPRESS_EXTENSIONS):
+                    created += precompress_file(os.path.join(root, name))
+    if brotli is None:
+        click.echo("Пакет brotli не установлен - созданы только .gz файлы")
+    click.echo(f"Создано сжатых файлов: {created}")
+
+
+def init_static_assets(app):
+    """Подключает хэши в URL статики, сжатые копии, передачу файлов фронтовому серверу
+    и заголовки кэширования"""
+    app.url_defaults(add_static_hash)
+    # В режиме передачи файлов сжатые копии отдает фронтовой сервер (gzip_static в nginx)
+    app.before_request(offload_static)
+    app.before_request(serve_precompressed)
+    app.after_request(set_static_cache_headers)
+    app.cli.add_command(compress_static_command)
@@ -0,0 +1,73 @@
+"""Префиксный индекс для подсказок при вводе поискового запроса.
+Хранит отсортированный список ключей (название, начиная с каждого слова)
+и ищет по префиксу двоичным поиском"""
+import threading
+from bisect import bisect_left
+
+
+# Максимальное количество подсказок в одном ответе
+SUGGEST_LIMIT = 10
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+class SuggestIndex:
+    def __init__(self):
+        self._keys = []
+        self._entries = []
+        self._lock = threading.Lock()
+        self.ready = False
+        # Номер сброса: увеличивается в invalidate()
+        self.generation = 0
+
+    def build(self, *, subcategories, products, generation=None):
+        """Строит индекс. subcategories и products - списки пар (название, slug).
+        generation - значение self.generation до чтения данных из БД: если за это время
+        индекс был сброшен, данные могли устареть и индекс остается неготовым"""
+        entries = [('subcategory', name, slug) for name, slug in subcategories] + \
+                  [('product', name, slug) for name, slug in products]
+
+        keys = []
+        for position, (_, name, _) in enumerate(entries):
+            words = normalize(name).split(' ')
+            # Подсказка находится по началу любого слова названия
+            for i in range(len(words)):
+                keys.append((' '.join(words[i:]), position))
+        keys.sort()
+
+        # Подменяем данные целиком, чтобы параллельные запросы видели согласованное состояние
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self.ready = generation is None or generation == self.generation
+
+    def invalidate(self):
+        """Помечает индекс устаревшим (будет перестроен при следующем запросе)"""
+        with self._lock:
+            self.generation += 1
+            self.ready = False
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """Возвращает до limit записей (тип, название, slug), начинающихся с prefix.
+        Подкатегории выводятся раньше товаров"""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        limit = max(1, min(limit, SUGGEST_LIMIT))
+
+        with self._lock:
+            keys, entries = self._keys, self._entries
+
+        found = set()
+        i = bisect_left(keys, (prefix,))
+        # Просматриваем ограниченное число ключей, чтобы ответ не зависел от размера каталога
+        while i < len(keys) and len(found) < limit * 4 and keys[i][0].startswith(prefix):
+            found.add(keys[i][1])
+            i += 1
+
+        return [entries[position] for position in sorted(found)[:limit]]
+
+
+suggest_index = SuggestIndex()
@@ -1,2 +1,2 @@
-from .tasks import cancel_expired_orders
+from .tasks import cancel_expired_orders, refresh_featured_products
 from .sheduler import setup_scheduler
\ No newline at end of file
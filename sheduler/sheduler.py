@@ -1,6 +1,6 @@
 from flask_apscheduler import APScheduler
 
-from sheduler import cancel_expired_orders
+from sheduler import cancel_expired_orders, refresh_featured_products
 
 
 def setup_scheduler(db, app) -> APScheduler:
@@ -17,4 +17,13 @@ def setup_scheduler(db, app) -> APScheduler:
         hours=1
     )
 
+    # Каждые 10 минут обновляет набор товаров для главной страницы
+    scheduler.add_job(
+        id='refresh_featured_products',
+        func=refresh_featured_products,
+        kwargs={'db': db, 'app': app},
+        trigger='interval',
+        minutes=10
+    )
+
     return scheduler
\ No newline at end of file
@@ -1,7 +1,7 @@
 import logging
 from datetime import datetime, timedelta
 
-from services import CartService
+from services import CartService, ProductService
 
 
 logger = logging.getLogger(__name__)
@@ -16,4 +16,11 @@ def cancel_expired_orders(db, app):
         expired_orders = cart_service.get_expired_orders(cutoff=cutoff)
         for order in expired_orders:
             cart_service.cancel_order(order_id=order.id)
-            logger.info(f"Заказ {order.id} отменен")
\ No newline at end of file
+            logger.info(f"Заказ {order.id} отменен")
+
+
+def refresh_featured_products(db, app):
+    """Периодически обновляет набор товаров для главной страницы"""
+    with app.app_context():
+        count = ProductService(db).refresh_featured_products()
+        logger.debug(f"Набор товаров для главной страницы обновлен: {count} шт.")